@@ -11,42 +11,1344 @@
                 <option label="5 minutes" value="300"/>
             </options>
         </param>
+        <param field="Mode4" label="Refresh unchanged devices" width="100px" required="true">
+            <options>
+                <option label="Every poll" value="0"/>
+                <option label="5 minutes" value="5"/>
+                <option label="15 minutes" value="15" default="true"/>
+                <option label="60 minutes" value="60"/>
+            </options>
+        </param>
+        <param field="Mode5" label="Options" width="300px" default=""/>
     </params>
 </plugin>
 """
 import Domoticz
 import base64
+import cProfile
+import glob
+import io
+import pstats
+import tracemalloc
 import hashlib
 import json
+import os
 import urllib
+import urllib.parse
 import secrets
+import random
+import re
 import requests
 import datetime
 import calendar
 import time
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from collections import Counter, deque
+from requests.adapters import HTTPAdapter
+try:
+    import fcntl
+except ImportError:
+    # No file locking (Windows): the shared cache option is not available
+    fcntl = None
+
+CLIENT_ID = "6ce007c6-0628-419e-88f4-bee2e6418eec"
+SUBSCRIPTION_KEY = "df605c5470d846fc91e848b1cc653ddf"
+# The cloud endpoints can be pointed elsewhere (e.g. tools/mock_server.py) through the environment
+LOGIN_BASE_URL = os.environ.get(
+    "REMEHA_LOGIN_BASE_URL", "https://remehalogin.bdrthermea.net/bdrb2cprod.onmicrosoft.com"
+).rstrip("/")
+API_BASE_URL = os.environ.get("REMEHA_API_BASE_URL", "https://api.bdrthermea.net/Mobile/api").rstrip("/")
+LOGIN_HOST = urllib.parse.urlparse(LOGIN_BASE_URL).hostname
+# Returned by fetch_dashboard when the dashboard did not change since the previous poll
+UNCHANGED = object()
+# Seconds to wait for more setpoint/zone mode changes before sending the merged command
+COMMAND_DEBOUNCE = 2
+# Adaptive polling: the fast interval is used for FAST_POLL_PERIOD seconds after a command and
+# while the zone is asking for heat; when idle the configured interval is doubled up to IDLE_POLL_MAX
+FAST_POLL_INTERVAL = 30
+FAST_POLL_PERIOD = 300
+IDLE_POLL_MAX = 600
+# The energy API is only updated once an hour, fetch it at this minute past the hour
+ENERGY_MINUTE = 5
+# Profiling: default sample rate (one in N calls) and the number of reports kept per call type
+PROFILE_EVERY = 20
+PROFILE_KEEP = 10
+# Shared cache: an energy update of another instance younger than this (seconds) is reused
+SHARED_ENERGY_AGE = 900
+# Energy requests that may run at the same time, at most the connection pool size of the session.
+# The energy pool has one thread more for the backfill, so it never holds up an energy update.
+ENERGY_WORKERS = 4
+# Sample store: days the hourly samples are kept by default, seconds between batched inserts
+SAMPLES_DAYS = 365
+SAMPLES_FLUSH = 300
+# Energy backfill: days of history fetched per request and seconds between two requests
+BACKFILL_CHUNK_DAYS = 92
+BACKFILL_INTERVAL = 60
+# History writes per heartbeat, so a chunk does not block the plugin thread, and the first
+# Domoticz version that accepts dated meter updates
+BACKFILL_WRITES = 20
+BACKFILL_MIN_VERSION = (2023, 1)
+# Renew the access token this many seconds before it expires
+TOKEN_RENEW_MARGIN = 120
+# Seconds onStop waits for the worker; a request in flight is not interrupted by closing the session
+STOP_TIMEOUT = 5
+# Domoticz complains about heartbeats longer than 30 seconds
+MAX_HEARTBEAT = 30
+# After a command the dashboard is polled every CONFIRM_INTERVAL seconds until it shows the new
+# state, at most CONFIRM_POLLS times
+CONFIRM_INTERVAL = 5
+CONFIRM_POLLS = 6
+# Seconds between metric device updates and between summary log lines
+METRICS_INTERVAL = 300
+REPORT_INTERVAL = 3600
+METRICS_UNIT = 13
+# Live COP derived from the estimated consumed and delivered power
+COP_UNIT = 14
+# The power estimate falls back to zero when there was no energy update for this many seconds.
+# The API moves the daily energy once an hour, so an unchanged value that comes sooner than
+# POWER_MIN_INTERVAL after the previous one says nothing about the power.
+POWER_STALE = 7200
+POWER_MIN_INTERVAL = 1800
+# Default connect and read timeouts of every API request, and the time one poll cycle may spend
+# on login and dashboard before the energy fetch is deferred to the next cycle (seconds).
+# They can be changed with the connect_timeout, read_timeout and cycle_budget options.
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 20
+CYCLE_BUDGET = 30
+# Returned by the energy poll when it was deferred to the next cycle
+DEFERRED = object()
+
+def token_expiry(token):
+    # The exp claim of a JWT access token, None when it cannot be read
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except Exception:
+        return None
+
+def seconds_until_minute(minute):
+    # Seconds until the clock next shows the given minute of the hour
+    now = datetime.datetime.now()
+    target = now.replace(minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += datetime.timedelta(hours=1)
+    return (target - now).total_seconds()
+
+class Scheduler:
+    # Next-due times per task (dashboard, energy, token). Overdue tasks are returned once by
+    # due() and stay out of the schedule until the caller plans them again.
+    def __init__(self):
+        self._deadlines = {}
+
+    def schedule(self, task, delay):
+        self._deadlines[task] = time.monotonic() + max(0, delay)
+
+    def schedule_before(self, task, delay):
+        # Move a task forward, never postpone it
+        deadline = time.monotonic() + max(0, delay)
+        if task not in self._deadlines or deadline < self._deadlines[task]:
+            self._deadlines[task] = deadline
+
+    def scheduled(self, task):
+        return task in self._deadlines
+
+    def due(self):
+        now = time.monotonic()
+        tasks = [task for task, deadline in self._deadlines.items() if deadline <= now]
+        for task in tasks:
+            del self._deadlines[task]
+        return tasks
+
+    def next_deadline(self):
+        # Seconds until the nearest deadline, None when nothing is scheduled
+        if not self._deadlines:
+            return None
+        return max(0, min(self._deadlines.values()) - time.monotonic())
+
+class TokenManager:
+    # Holds the OAuth2 tokens of the plugin. An expired access token is renewed with
+    # the refresh token (one request), the full B2C credential login is only used
+    # when there is no refresh token yet or when refreshing fails.
+    # Renewal is single-flight: the first caller that needs a new token renews it, callers that
+    # arrive meanwhile (poll, command, scheduled renewal) wait for that result instead of
+    # starting a login of their own. The expiry is decoded once per token and cached.
+    def __init__(self, api):
+        self._api = api
+        self.access_token = None
+        self.refresh_token = None
+        self._expires_at = None
+        self._state = None
+        self._lock = threading.Lock()
+        self._flight = None
+
+    def load(self, state):
+        # Take over the tokens of a previous run, they are validated on first use
+        self._state = state
+        self.access_token = state.get("access_token")
+        self.refresh_token = state.get("refresh_token")
+        self._expires_at = token_expiry(self.access_token) if self.access_token else None
+
+    def valid(self):
+        # True when the access token is still valid for at least 5 seconds
+        return self._expires_at is not None and time.time() + 5 < self._expires_at
+
+    def get_access_token(self, force_renew=False):
+        # Return a valid access token, or None when no token could be obtained. With force_renew
+        # the token is renewed even when it is still valid (proactive renewal by the scheduler).
+        if not force_renew and self.valid():
+            return self.access_token
+        with self._lock:
+            flight = self._flight
+            if flight is None:
+                # A renewal that finished while this caller was waiting for the lock counts
+                if not force_renew and self.valid():
+                    return self.access_token
+                flight = self._flight = {"done": threading.Event(), "token": None}
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            flight["done"].wait()
+            return flight["token"]
+        try:
+            flight["token"] = self._renew()
+            return flight["token"]
+        finally:
+            with self._lock:
+                self._flight = None
+            flight["done"].set()
+
+    def _renew(self):
+        # With the shared cache another instance may already have renewed the token; it is
+        # taken over when it is valid well beyond the renewal margin. Otherwise this instance
+        # renews it while holding the cache lock and shares the result.
+        shared = self._api.shared
+        if shared is None:
+            return self._request()
+        with shared.locked() as data:
+            tokens = data.get("tokens") if isinstance(data.get("tokens"), dict) else {}
+            expires_at = token_expiry(tokens.get("access_token") or "")
+            if (
+                tokens.get("access_token") != self.access_token
+                and expires_at is not None
+                and expires_at > time.time() + TOKEN_RENEW_MARGIN
+            ):
+                self._store(tokens)
+                return self.access_token
+            access_token = self._request()
+            if access_token is not None:
+                data["tokens"] = {"access_token": self.access_token, "refresh_token": self.refresh_token}
+            return access_token
+
+    def _request(self):
+        # Refresh and credential login share the login breaker: while it is open no request is made.
+        # Neither is started while the plugin stops.
+        if self._api.stopping.is_set():
+            return None
+        breaker = self._api.breakers["login"]
+        if not breaker.allow():
+            return None
+
+        if self.refresh_token:
+            try:
+                self._store(self._api._request_new_token({
+                    "grant_type": "refresh_token",
+                    "refresh_token": self.refresh_token,
+                    "client_id": CLIENT_ID,
+                }))
+                breaker.success()
+                return self.access_token
+            except Exception as e:
+                if is_outage(e):
+                    # An outage says nothing about the refresh token: keep it and back off
+                    # instead of sending the password
+                    Domoticz.Error(f"Token refresh failed: {e}")
+                    breaker.failure()
+                    return None
+                Domoticz.Log(f"Token refresh failed, logging in again: {e}")
+                self.refresh_token = None
+                if self._state is not None:
+                    self._state.update(refresh_token=None)
+
+        try:
+            result = self._api.resolve_external_data()
+        except Exception:
+            breaker.failure()
+            raise
+        if result is None:
+            if not self._api.stopping.is_set():
+                breaker.failure()
+            return None
+        breaker.success()
+        self._api.metrics.count_login()
+        self._store(result)
+        return self.access_token
+
+    def expires_at(self):
+        # Unix timestamp at which the current access token expires, None when unknown
+        return self._expires_at
+
+    def _store(self, result):
+        self.access_token = result.get("access_token")
+        self._expires_at = token_expiry(self.access_token) if self.access_token else None
+        # The token endpoint does not always rotate the refresh token, keep the old one then
+        if result.get("refresh_token"):
+            self.refresh_token = result["refresh_token"]
+        if self._state is not None:
+            self._state.update(access_token=self.access_token, refresh_token=self.refresh_token)
+
+def endpoint_name(url):
+    # Endpoint class of a request URL, used to group the metrics
+    if "/oauth2/v2.0/token" in url:
+        return "token"
+    if url.startswith(LOGIN_BASE_URL):
+        return "login"
+    if "/homes/dashboard" in url:
+        return "dashboard"
+    if "/energyconsumption/" in url:
+        return "energy"
+    if "/climate-zones/" in url:
+        return "command"
+    return "other"
+
+class Metrics:
+    # Rolling latency and status codes per endpoint class, plus logins per day.
+    # Filled by InstrumentedAdapter for every request the session makes.
+    ENDPOINTS = ("login", "token", "dashboard", "energy", "command")
+    WINDOW = 200
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._status = {}
+        self._logins = Counter()
+
+    def record(self, endpoint, seconds, status):
+        with self._lock:
+            self._latency.setdefault(endpoint, deque(maxlen=self.WINDOW)).append(seconds)
+            self._status.setdefault(endpoint, Counter())[status] += 1
+
+    def count_login(self):
+        with self._lock:
+            self._logins[datetime.date.today().isoformat()] += 1
+            # Only today matters, forget older days
+            for day in [day for day in self._logins if day != datetime.date.today().isoformat()]:
+                del self._logins[day]
+
+    def logins_today(self):
+        with self._lock:
+            return self._logins[datetime.date.today().isoformat()]
+
+    def summary(self, endpoint):
+        # p50/p95/max latency in milliseconds over the window, request and error counts
+        with self._lock:
+            samples = sorted(self._latency.get(endpoint, ()))
+            statuses = Counter(self._status.get(endpoint, ()))
+        if not samples:
+            return None
+        errors = sum(count for status, count in statuses.items() if not isinstance(status, int) or status >= 400)
+        return {
+            "p50": samples[len(samples) // 2] * 1000,
+            "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+            "max": samples[-1] * 1000,
+            "requests": sum(statuses.values()),
+            "errors": errors,
+            "statuses": dict(statuses),
+        }
+
+    def report(self):
+        parts = []
+        for endpoint in self.ENDPOINTS:
+            summary = self.summary(endpoint)
+            if summary is not None:
+                parts.append(
+                    f"{endpoint} p50={summary['p50']:.0f}ms p95={summary['p95']:.0f}ms max={summary['max']:.0f}ms "
+                    f"n={summary['requests']} err={summary['errors']}"
+                )
+        parts.append(f"logins today={self.logins_today()}")
+        return "; ".join(parts)
+
+class InstrumentedAdapter(HTTPAdapter):
+    # Times every request and records its status code (or exception)
+    def __init__(self, metrics, **kwargs):
+        self.metrics = metrics
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception as e:
+            self.metrics.record(endpoint_name(request.url), time.perf_counter() - start, type(e).__name__)
+            raise
+        self.metrics.record(endpoint_name(request.url), time.perf_counter() - start, response.status_code)
+        return response
+
+def is_outage(error):
+    # Errors that mean the cloud is unreachable or overloaded, as opposed to a rejected request
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return False
+
+class CircuitBreaker:
+    # Guards one endpoint class (login, dashboard, energy, command). After `threshold` consecutive
+    # failures the breaker opens and calls are refused for a backoff window that doubles with
+    # every failed probe, up to `cap` seconds, with jitter so instances do not retry in lockstep.
+    # Once the window has passed a single call is let through as a half-open probe; its success
+    # closes the breaker, its failure opens it again for a longer window.
+    def __init__(self, name, threshold, base, cap):
+        self.name = name
+        self.threshold = threshold
+        self.base = base
+        self.cap = cap
+        self.state = "closed"
+        self.failures = 0
+        self._opened = 0
+        self._retry_at = 0
+        # Wall clock time of _retry_at, for the Status device
+        self._retry_time = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "closed":
+                return True
+            # A probe that never reported back does not keep the breaker half-open forever
+            if now >= self._retry_at and (self.state == "open" or now >= self._retry_at + self.cap):
+                self.state = "half-open"
+                self._retry_at = now
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.state != "closed":
+                Domoticz.Log(f"Remeha Home {self.name} calls are working again")
+            self.state = "closed"
+            self.failures = 0
+            self._opened = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half-open" or self.failures >= self.threshold:
+                self._opened += 1
+                window = min(self.cap, self.base * 2 ** (self._opened - 1))
+                window = random.uniform(window / 2, window)
+                self._retry_at = time.monotonic() + window
+                self._retry_time = time.time() + window
+                self.state = "open"
+                Domoticz.Error(f"Remeha Home {self.name} calls are failing, next attempt in {window:.0f} seconds")
+
+    def report(self, error):
+        # Only outages count against the breaker, a rejected request proves the API is up
+        if error is not None and is_outage(error):
+            self.failure()
+        else:
+            self.success()
+
+    def retry_in(self):
+        with self._lock:
+            return max(0, self._retry_at - time.monotonic())
+
+    def describe(self):
+        # Only changes when the breaker changes state, so the Status device is not rewritten every heartbeat
+        if self.state == "closed":
+            return None
+        if self.state == "half-open":
+            return f"{self.name} probing"
+        return f"{self.name} down until {time.strftime('%H:%M:%S', time.localtime(self._retry_time))}"
+
+# Breaker settings per endpoint class: consecutive failures before opening, first and longest
+# backoff window in seconds. A single failed login opens its breaker to avoid account lockout.
+BREAKERS = {
+    "login": (1, 60, 3600),
+    "dashboard": (3, 30, 900),
+    "energy": (2, 300, 3600),
+    "command": (2, 30, 600),
+}
+
+def create_session(metrics):
+    # One keep-alive session is used for the whole plugin lifetime so heartbeats reuse the
+    # TCP/TLS connections to the login and API hosts instead of handshaking on every poll.
+    # Failed calls are not retried here; the circuit breakers decide when to try again.
+    session = requests.Session()
+    adapter = InstrumentedAdapter(metrics, pool_connections=2, pool_maxsize=4, pool_block=False)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+def parse_options(value):
+    # The Options field holds "key" or "key=value" items separated by ';' or ','
+    options = {}
+    for item in value.replace(",", ";").split(";"):
+        key, _, option = item.strip().partition("=")
+        if key:
+            options[key.strip().lower()] = option.strip() or "1"
+    return options
+
+def option_seconds(options, name, default):
+    # A positive number of seconds from the Options field, the default when missing or invalid
+    try:
+        value = float(options.get(name, default))
+    except ValueError:
+        value = 0
+    if value <= 0:
+        Domoticz.Error(f"Invalid value for option {name}, using {default} seconds")
+        return default
+    return value
+
+def domoticz_version():
+    # (year, minor) of the running Domoticz, e.g. (2024, 7) for "2024.7 (build 16222)";
+    # None when it cannot be parsed
+    match = re.match(r"\s*(\d+)\.(\d+)", Parameters.get("DomoticzVersion") or "")
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+def plugin_data_path(name, extension="json"):
+    # Per-hardware file in the plugin folder for data that has to survive restarts
+    return os.path.join(Parameters["HomeFolder"], f"remeha_{name}_{Parameters['HardwareID']}.{extension}")
+
+class StateStore:
+    # Tokens and the discovered appliance/climate zone ids, persisted so a restart needs no
+    # login and commands work before the first dashboard poll. The file holds credentials,
+    # so it is only readable by the Domoticz user. Values are checked lazily when used.
+    def __init__(self, path, email):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = self._load(email)
+
+    def _load(self, email):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if not isinstance(data, dict) or data.get("email") != email:
+                # Another account was configured, start from scratch
+                return {"email": email}
+            return data
+        except FileNotFoundError:
+            return {"email": email}
+        except Exception as e:
+            Domoticz.Log(f"State file {self.path} is unreadable, ignoring it: {e}")
+            return {"email": email}
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def update(self, **values):
+        with self._lock:
+            if all(self._data.get(key) == value for key, value in values.items()):
+                return
+            self._data.update(values)
+            try:
+                tmp_path = self.path + ".tmp"
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self._data, f)
+                os.chmod(tmp_path, 0o600)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                Domoticz.Error(f"Could not write state file {self.path}: {e}")
+
+class Profiler:
+    # Opt-in sampling profiler for the plugin callbacks and the worker jobs. One in `every`
+    # calls of each kind runs under cProfile and tracemalloc; its .prof file and a text report
+    # with the top functions and allocation sites are written to the plugin folder, keeping
+    # the newest `keep` reports per kind. Only one call is sampled at a time, as tracemalloc
+    # traces the whole process.
+    def __init__(self, directory, every, keep=PROFILE_KEEP):
+        self.directory = directory
+        self.every = every
+        self.keep = keep
+        self._calls = Counter()
+        self._sampling = threading.Lock()
+
+    def call(self, name, func, *args):
+        self._calls[name] += 1
+        if self._calls[name] % self.every or not self._sampling.acquire(blocking=False):
+            return func(*args)
+        try:
+            # Leave tracemalloc alone when something else (a benchmark) is already tracing
+            tracing = tracemalloc.is_tracing()
+            if not tracing:
+                tracemalloc.start()
+            profile = cProfile.Profile()
+            start = time.perf_counter()
+            profile.enable()
+            try:
+                return func(*args)
+            finally:
+                profile.disable()
+                elapsed = time.perf_counter() - start
+                snapshot = tracemalloc.take_snapshot()
+                if not tracing:
+                    tracemalloc.stop()
+                self._write(name, profile, snapshot, elapsed)
+        finally:
+            self._sampling.release()
+
+    def _write(self, name, profile, snapshot, elapsed):
+        prefix = os.path.join(self.directory, f"remeha_profile_{Parameters['HardwareID']}_{name}_")
+        path = prefix + datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        try:
+            profile.dump_stats(path + ".prof")
+            report = io.StringIO()
+            report.write(f"{name} call {self._calls[name]}, {elapsed * 1000:.1f} ms\n\n")
+            pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(25)
+            report.write("Top allocations:\n")
+            for statistic in snapshot.statistics("lineno")[:15]:
+                report.write(f"{statistic}\n")
+            with open(path + ".txt", "w") as f:
+                f.write(report.getvalue())
+            # Rotate: drop the oldest reports of this kind
+            for old in sorted(glob.glob(glob.escape(prefix) + "*.prof"))[:-self.keep]:
+                for extension in (".prof", ".txt"):
+                    try:
+                        os.remove(old[:-len(".prof")] + extension)
+                    except FileNotFoundError:
+                        pass
+        except OSError as e:
+            Domoticz.Error(f"Could not write profile {path}: {e}")
+
+def shared_cache_path(email):
+    # One shared cache per account in the plugin folder, used by every hardware instance
+    account = hashlib.sha1(email.strip().lower().encode("utf-8")).hexdigest()[:16]
+    return os.path.join(Parameters["HomeFolder"], f"remeha_shared_{account}.json")
+
+class SharedCache:
+    # Tokens and the latest dashboard and energy responses of one account, shared by all
+    # hardware instances of the plugin that use that account. Every access holds an exclusive
+    # file lock, also while the instance fetches what it did not find, so only one instance
+    # logs in or polls at a time and the others reuse its result. The file holds tokens and
+    # is only readable by the Domoticz user.
+    def __init__(self, path):
+        self.path = path
+        # flock does not exclude threads of the same process that open the lock file again
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        # Yields the cache contents as a dict; changes are written back when the block ends
+        # without an exception
+        with self._lock, open(self.path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                data = self._load()
+                before = json.dumps(data, sort_keys=True)
+                yield data
+                if json.dumps(data, sort_keys=True) != before:
+                    self._save(data)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            Domoticz.Log(f"Shared cache {self.path} is unreadable, starting a new one: {e}")
+            return {}
+
+    def _save(self, data):
+        try:
+            tmp_path = self.path + ".tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            Domoticz.Error(f"Could not write shared cache {self.path}: {e}")
+
+class EnergyCache:
+    # Partial energy sums of closed periods (previous years, closed months of the current
+    # year) persisted as JSON, keyed by appliance id and period. Closed periods never change,
+    # so the hourly energy update only has to fetch the open month and today. A missing or
+    # corrupt file simply starts an empty cache that is rebuilt on the next update.
+    def __init__(self, path):
+        self.path = path
+        self._data = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError("unexpected cache layout")
+            return data
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            Domoticz.Log(f"Energy cache {self.path} is unreadable, rebuilding it: {e}")
+            return {}
+
+    def get(self, appliance_id, period):
+        entry = self._data.get(str(appliance_id), {}).get(period)
+        if (
+            isinstance(entry, list)
+            and len(entry) == 2
+            and all(isinstance(value, (int, float)) for value in entry)
+        ):
+            return tuple(entry)
+        return None
+
+    def put(self, appliance_id, period, consumed, delivered):
+        appliance = self._data.setdefault(str(appliance_id), {})
+        if not isinstance(appliance, dict):
+            appliance = self._data[str(appliance_id)] = {}
+        # Only the latest period of each kind is useful, older ones are dropped on rollover
+        kind = period.split(":")[0]
+        for key in [key for key in appliance if key.split(":")[0] == kind]:
+            del appliance[key]
+        appliance[period] = [consumed, delivered]
+        self._save()
+
+    def _save(self):
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            Domoticz.Error(f"Could not write energy cache {self.path}: {e}")
+
+# Dashboard mapping table, one row per Domoticz device:
+#   unit, device definition, scope, JSON path, converter, formatter (value -> (nValue, sValue)), Options
+# The scope selects the object the path is read from: the appliance, its climate zone or its hot water
+# zone. An empty path passes the whole scope object to the converter. Rows whose value is missing or
+# converts to None are skipped. compile_dashboard_table() turns the rows into accessor callables once.
+def svalue(value):
+    return 0, str(value)
+
+def outdoor_temperature(appliance):
+    # The wired sensor when the appliance has one, the cloud (internet) temperature otherwise
+    if appliance.get("capabilityOutdoorTemperature") is not True:
+        return None
+    information = appliance["outdoorTemperatureInformation"]
+    if information["outdoorTemperatureSource"] == "Wired":
+        return information["applianceOutdoorTemperature"]
+    return information["cloudOutdoorTemperature"]
+
+ZONE_MODE_LEVELS = {
+    "Scheduling": (1, "0"),
+    "Manual": (10, "10"),
+    "TemporaryOverride": (20, "20"),
+    "FrostProtection": (0, "30"),
+}
+# zoneMode selector level of a command to the zone mode it sets
+ZONE_MODE_NAMES = {0: "Scheduling", 10: "Manual", 20: "TemporaryOverride", 30: "FrostProtection"}
+
+def zone_mode_level(value):
+    return ZONE_MODE_LEVELS.get(value)
+
+def pressure_alarm(value):
+    return (0, "Off") if value == True else (1, "On")
+
+DASHBOARD_FIELDS = (
+    (1, dict(Name="roomTemperature", TypeName="Temperature"), "zone", "roomTemperature", None, svalue, None),
+    (2, dict(Name="outdoorTemperature", TypeName="Temperature"), "appliance", "", outdoor_temperature, svalue, None),
+    (3, dict(Name="waterPressure", TypeName="Pressure"), "appliance", "waterPressure", None, svalue, None),
+    (4, dict(Name="setPoint", TypeName="Setpoint"), "zone", "setPoint", None, svalue, None),
+    (5, dict(Name="dhwTemperature", TypeName="Temperature"), "hot_water", "dhwTemperature", None, svalue, None),
+    (7, dict(Name="gasCalorificValue", Type=243, Subtype=31), "appliance", "gasCalorificValue", None, svalue, {"Custom": "1;kWh/m³"}),
+    (8, dict(Name="zoneMode", TypeName="Selector Switch", Image=15, Options={"LevelNames": "Scheduling|Manual|TemporaryOverride|FrostProtection", "LevelOffHidden": "false", "SelectorStyle": "1"}), "zone", "zoneMode", None, zone_mode_level, None),
+    (9, dict(Name="waterPressureToLow", TypeName="Switch", Switchtype=0, Image=13), "appliance", "waterPressureOK", None, pressure_alarm, None),
+    (11, dict(Name="Status", TypeName="Text", Image=15), "zone", "activeComfortDemand", None, svalue, None),
+)
+
+def heat_demand(value):
+    # activeComfortDemand as a number, so the hourly average is the share of time asking for heat
+    return 0.0 if value == "Idle" else 1.0
+
+# Values kept in the sample store on every poll: series name, scope, JSON path, converter
+SAMPLE_FIELDS = (
+    ("roomTemperature", "zone", "roomTemperature", None),
+    ("setPoint", "zone", "setPoint", None),
+    ("heatDemand", "zone", "activeComfortDemand", heat_demand),
+    ("outdoorTemperature", "appliance", "", outdoor_temperature),
+    ("waterPressure", "appliance", "waterPressure", None),
+    ("dhwTemperature", "hot_water", "dhwTemperature", None),
+)
+
+# Devices written by the energy update
+ENERGY_DEVICES = (
+    (6, dict(Name="EnergyConsumption", Type=243, TypeName="Kwh", Subtype=29)),
+    (10, dict(Name="EnergyDelivered", Type=243, TypeName="Kwh", Subtype=29, Switchtype=4)),
+    (12, dict(Name="seasonalEfficiency", Type=243, Subtype=31)),
+    (COP_UNIT, dict(Name="COP", Type=243, Subtype=31, Options={"Custom": "1;COP"})),
+)
+
+def compile_path(path):
+    # Accessor for a dotted JSON path ("a.0.b"), returning None when any step is missing
+    keys = tuple(int(key) if key.isdigit() else key for key in path.split(".")) if path else ()
+    if not keys:
+        return lambda data: data
+
+    def read(data):
+        try:
+            for key in keys:
+                data = data[key]
+            return data
+        except (KeyError, IndexError, TypeError):
+            return None
+    return read
+
+def compile_dashboard_table(fields):
+    # Precompile the mapping table into {scope: [(unit, accessor, Options, device)]}; the accessor
+    # reads, converts and formats in one call and returns None when the device is skipped
+    compiled = {}
+    for unit, device, scope, path, convert, format, options in fields:
+        def accessor(data, read=compile_path(path), convert=convert, format=format):
+            value = read(data)
+            if value is not None and convert is not None:
+                value = convert(value)
+            if value is None:
+                return None
+            return format(value)
+        compiled.setdefault(scope, []).append((unit, accessor, options, device))
+    return {scope: tuple(rows) for scope, rows in compiled.items()}
+
+def compile_sample_table(fields):
+    # Precompile the sample fields into {scope: [(name, accessor)]}; the accessor returns the
+    # value as a float, or None when the dashboard does not have it
+    compiled = {}
+    for name, scope, path, convert in fields:
+        def accessor(data, read=compile_path(path), convert=convert):
+            value = read(data)
+            if value is not None and convert is not None:
+                value = convert(value)
+            try:
+                return None if value is None else float(value)
+            except (TypeError, ValueError):
+                return None
+        compiled.setdefault(scope, []).append((name, accessor))
+    return {scope: tuple(rows) for scope, rows in compiled.items()}
+
+# Identifier and display name of the object behind each scope of the mapping table
+SCOPE_KEYS = {
+    "appliance": ("applianceId", "applianceName"),
+    "zone": ("climateZoneId", "name"),
+    "hot_water": ("hotWaterZoneId", "name"),
+}
+# Units handed out to the devices of additional appliances and zones start here
+FIRST_DYNAMIC_UNIT = 20
+
+class UnitMap:
+    # Stable device units per appliance, climate zone and hot water zone. The first object seen
+    # of each scope (the primary one) keeps the classic units of the mapping table; every other
+    # object gets its own units from FIRST_DYNAMIC_UNIT on. The map lives in the state file, so
+    # units survive restarts and changes in the order the API lists zones in.
+    def __init__(self, state):
+        self._state = state
+        self.primary = dict(state.get("primary") or {})
+        self._units = dict(state.get("units") or {})
+        self._owners = {unit: key for key, unit in self._units.items()}
+        # Installs from before multi-zone support: the stored ids are the primary ones
+        if "appliance" not in self.primary and state.get("appliance_id"):
+            self.primary["appliance"] = state.get("appliance_id")
+        if "zone" not in self.primary and state.get("climate_zone_id"):
+            self.primary["zone"] = state.get("climate_zone_id")
+
+    def unit(self, scope, object_id, base_unit):
+        # Unit of the device for base_unit of the given object, allocated on first use
+        if self.primary.get(scope) is None:
+            self.primary[scope] = object_id
+            self._state.update(primary=dict(self.primary))
+        if object_id == self.primary[scope]:
+            return base_unit
+        key = f"{scope}:{object_id}:{base_unit}"
+        unit = self._units.get(key)
+        if unit is None:
+            unit = FIRST_DYNAMIC_UNIT
+            while unit in self._owners or unit in Devices:
+                unit += 1
+            if unit > 255:
+                raise ValueError("no free device units left")
+            self._units[key] = unit
+            self._owners[unit] = key
+            self._state.update(units=dict(self._units))
+        return unit
+
+    def owner(self, unit, scope, base_units):
+        # (object id, base unit) of a device unit in the given scope, None if it is not one of base_units
+        if unit in base_units:
+            return self.primary.get(scope), unit
+        key = self._owners.get(unit)
+        if key is None:
+            return None
+        key_scope, object_id, base_unit = key.split(":")
+        if key_scope != scope or int(base_unit) not in base_units:
+            return None
+        return object_id, int(base_unit)
+
+class SampleStore:
+    # Local time series of the polled values in SQLite, so trends (for example a slowly
+    # dropping water pressure) can be analysed without cloud calls or the Domoticz database.
+    # Samples are buffered in memory and inserted in batches by flush(). Raw samples are kept
+    # for raw_days; older ones only survive as hourly mean/min/max rows, kept for days.
+    def __init__(self, path, days, raw_days=7):
+        self.path = path
+        self.days = days
+        self.raw_days = raw_days
+        self._buffer = []
+        self._series = {}
+        self._downsampled = 0
+        # _lock only guards the buffer, so add() on the plugin thread never waits for disk I/O;
+        # _db_lock guards the connection and the series ids
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS series (id INTEGER PRIMARY KEY, object TEXT NOT NULL, name TEXT NOT NULL, UNIQUE (object, name));
+                CREATE TABLE IF NOT EXISTS samples (series INTEGER NOT NULL, ts INTEGER NOT NULL, value REAL NOT NULL, PRIMARY KEY (series, ts)) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS hourly (series INTEGER NOT NULL, ts INTEGER NOT NULL, mean REAL, low REAL, high REAL, count INTEGER, PRIMARY KEY (series, ts)) WITHOUT ROWID;
+            """)
+        for series_id, object_id, name in self._db.execute("SELECT id, object, name FROM series"):
+            self._series[(object_id, name)] = series_id
+
+    def add(self, when, object_id, name, value):
+        with self._lock:
+            self._buffer.append((int(when), str(object_id), name, value))
+
+    def flush(self):
+        # Insert the buffered samples in one transaction, then downsample and apply the
+        # retention once an hour
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        with self._db_lock:
+            try:
+                with self._db:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO samples (series, ts, value) VALUES (?, ?, ?)",
+                        [(self._series_id(object_id, name), when, value) for when, object_id, name, value in rows],
+                    )
+                now = int(time.time())
+                if now - self._downsampled >= 3600:
+                    self._downsample(now)
+                    self._downsampled = now
+            except sqlite3.Error as e:
+                Domoticz.Error(f"Could not write sample store {self.path}: {e}")
+        return len(rows)
+
+    def _series_id(self, object_id, name):
+        series_id = self._series.get((object_id, name))
+        if series_id is None:
+            series_id = self._db.execute("INSERT INTO series (object, name) VALUES (?, ?)", (object_id, name)).lastrowid
+            self._series[(object_id, name)] = series_id
+        return series_id
+
+    def _downsample(self, now):
+        # (Re)build the hourly rows of the closed hours since the last downsampled hour
+        hour = now // 3600 * 3600
+        with self._db:
+            since = self._db.execute("SELECT COALESCE(MAX(ts), 0) FROM hourly").fetchone()[0]
+            self._db.execute(
+                "INSERT OR REPLACE INTO hourly (series, ts, mean, low, high, count) "
+                "SELECT series, ts / 3600 * 3600, AVG(value), MIN(value), MAX(value), COUNT(*) "
+                "FROM samples WHERE ts >= ? AND ts < ? GROUP BY series, ts / 3600",
+                (since, hour),
+            )
+            self._db.execute("DELETE FROM samples WHERE ts < ?", (now - self.raw_days * 86400,))
+            self._db.execute("DELETE FROM hourly WHERE ts < ?", (now - self.days * 86400,))
+
+    def series(self):
+        # The (object id, name) pairs that have samples
+        with self._db_lock:
+            return sorted(self._series)
+
+    def query(self, name, since, until=None, object_id=None, hourly=False):
+        # Samples of one series name from since to until (unix times), oldest first, as
+        # (object id, ts, value) rows, or (object id, ts, mean, low, high) rows with hourly=True.
+        # Without object_id the series of all appliances or zones are returned.
+        self.flush()
+        columns, table = ("mean, low, high", "hourly") if hourly else ("value", "samples")
+        query = (
+            f"SELECT series.object, {table}.ts, {columns} FROM {table} JOIN series ON series.id = {table}.series "
+            f"WHERE series.name = ? AND {table}.ts >= ? AND {table}.ts <= ?"
+        )
+        args = [name, int(since), int(time.time() if until is None else until)]
+        if object_id is not None:
+            query += " AND series.object = ?"
+            args.append(str(object_id))
+        with self._db_lock:
+            return self._db.execute(query + f" ORDER BY {table}.ts", args).fetchall()
+
+    def close(self):
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+class EnergyRate:
+    # Estimates the current consumed and delivered power from the daily energy values of the
+    # hourly energy updates, without extra API calls: the energy of the latest step divided by
+    # the time between the last two observations, so an update without growth gives 0 W. A
+    # drop in the values (a new day) starts over.
+    def __init__(self):
+        self._observations = deque(maxlen=2)
+
+    def add(self, when, consumed, delivered):
+        if self._observations:
+            last_when, last_consumed, last_delivered = self._observations[-1]
+            if consumed < last_consumed or delivered < last_delivered:
+                self._observations.clear()
+            elif (consumed, delivered) == (last_consumed, last_delivered) and when - last_when < POWER_MIN_INTERVAL:
+                return
+        self._observations.append((when, consumed, delivered))
+
+    def power(self, when):
+        # Consumed and delivered power in W (the energy values are in Wh)
+        if len(self._observations) < 2 or when - self._observations[-1][0] > POWER_STALE:
+            return 0.0, 0.0
+        (start, consumed_start, delivered_start), (end, consumed_end, delivered_end) = self._observations
+        hours = (end - start) / 3600
+        return (consumed_end - consumed_start) / hours, (delivered_end - delivered_start) / hours
+
+class DeviceWriter:
+    # Writes Domoticz devices only when nValue, sValue or Options differ from what was last
+    # written (and from what the device currently shows). Unchanged devices are still
+    # touched every touch_interval seconds so Domoticz does not mark them as timed out.
+    def __init__(self, touch_interval):
+        self.touch_interval = touch_interval
+        self._last = {}
+        self.written = 0
+        self.skipped = 0
+        self.touched = 0
+
+    def update(self, unit, nValue, sValue, Options=None):
+        if unit not in Devices:
+            return False
+        device = Devices[unit]
+        state = (nValue, str(sValue), dict(Options) if Options else None)
+        now = time.monotonic()
+        last = self._last.get(unit)
+        if last is not None and last[0] == state and device.nValue == nValue and device.sValue == state[1]:
+            if now - last[1] < self.touch_interval:
+                self.skipped += 1
+                return False
+            # Unchanged but due against the data timeout: Touch() only bumps the last seen
+            # time, without the events and history rows of a full Update()
+            device.Touch()
+            self._last[unit] = (state, now)
+            self.touched += 1
+            return False
+        if Options:
+            device.Update(nValue=nValue, sValue=state[1], Options=Options)
+        else:
+            device.Update(nValue=nValue, sValue=state[1])
+        self._last[unit] = (state, now)
+        self.written += 1
+        return True
+
+    def history(self, unit, sValue):
+        # Dated update that goes into the device history; it does not change the current
+        # value, so it bypasses the change detection
+        if unit not in Devices:
+            return False
+        Devices[unit].Update(nValue=0, sValue=sValue)
+        self.written += 1
+        return True
+
+    def touch_due(self):
+        # True when a written device has not been touched for touch_interval seconds
+        now = time.monotonic()
+        return any(now - written >= self.touch_interval for _, written in self._last.values())
+
+    def report(self):
+        # Summary of the writes since the previous report
+        summary = f"Device writes: {self.written} written, {self.touched} touched, {self.skipped} unchanged skipped"
+        self.written = 0
+        self.skipped = 0
+        self.touched = 0
+        return summary
+
+class CommandQueue:
+    # Pending setpoint and zone mode changes per climate zone. Changes for the same zone that
+    # arrive within `window` seconds of each other (slider drags, scenes, scripts) are merged
+    # and only the final intent is sent to the API.
+    def __init__(self, window):
+        self.window = window
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.received = 0
+        self.sent = 0
+
+    def add(self, zone_id, setpoint=None, mode=None, zone_mode_state=None, setpoint_state=None):
+        with self._lock:
+            intent = self._pending.get(zone_id)
+            if intent is None:
+                # The device state at the first command decides how a lone setpoint is sent
+                intent = self._pending[zone_id] = {
+                    "setpoint": None,
+                    "mode": None,
+                    "setpoint_last": False,
+                    "zone_mode_state": zone_mode_state,
+                    "setpoint_state": setpoint_state,
+                    "count": 0,
+                    "received": time.monotonic(),
+                }
+            if setpoint is not None:
+                intent["setpoint"] = setpoint
+                intent["setpoint_last"] = True
+            if mode is not None:
+                intent["mode"] = mode
+                intent["setpoint_last"] = False
+            intent["count"] += 1
+            intent["due"] = time.monotonic() + self.window
+            self.received += 1
+
+    def requeue(self, zone_id, intent, delay):
+        # Put back an intent that could not be sent; newer commands for the zone win
+        with self._lock:
+            if zone_id in self._pending:
+                return
+            self.sent -= 1
+            intent["due"] = time.monotonic() + delay
+            self._pending[zone_id] = intent
+
+    def next_due(self):
+        # Seconds until the first merged intent has to be sent, None when nothing is pending
+        with self._lock:
+            if not self._pending:
+                return None
+            return max(0, min(intent["due"] for intent in self._pending.values()) - time.monotonic())
+
+    def clear(self):
+        # Drop the intents that were not sent yet, returns how many there were
+        with self._lock:
+            dropped = len(self._pending)
+            self._pending.clear()
+        return dropped
+
+    def pop_due(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [zone_id for zone_id, intent in self._pending.items() if intent["due"] <= now]
+            intents = [(zone_id, self._pending.pop(zone_id)) for zone_id in due]
+            self.sent += len(intents)
+        return intents
+
+    @property
+    def saved(self):
+        return self.received - self.sent
+
+class Worker(threading.Thread):
+    # Runs all cloud I/O (login, dashboard, energy, commands) off the Domoticz plugin thread.
+    # Callbacks only submit jobs; the finished results are queued and picked up by the next
+    # heartbeat, which runs each job's on_done callback on the plugin thread. Merged commands
+    # from the CommandQueue are sent by send_commands as soon as their window has passed, its
+    # result goes to on_sent like the result of any other job.
+    def __init__(self, commands, send_commands, on_sent=None, profiler=None):
+        super().__init__(name="RemehaHomeWorker", daemon=True)
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.commands = commands
+        self._send_commands = send_commands
+        self._on_sent = on_sent
+        self.profiler = profiler
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def submit(self, name, func, *args, on_done=None, unique=False):
+        # Queue func(*args). With unique=True the job is dropped when one with the same name
+        # is still pending, so a slow API cannot pile up polls.
+        with self._lock:
+            if self._stopping.is_set() or (unique and self._pending.get(name)):
+                return False
+            self._pending[name] = self._pending.get(name, 0) + 1
+        self.jobs.put((name, func, args, on_done))
+        return True
+
+    def pending(self):
+        # Number of submitted jobs and merged commands that did not finish yet
+        with self._lock:
+            jobs = sum(self._pending.values())
+        return jobs + (self.commands.next_due() is not None)
+
+    def busy(self):
+        # True while jobs or merged commands are pending or results wait to be applied
+        return self.pending() > 0 or not self.results.empty()
+
+    def wake(self):
+        # Let the worker recompute when the next merged command is due
+        self.jobs.put(("wake", None, (), None))
+
+    def run(self):
+        while True:
+            try:
+                job = self.jobs.get(timeout=self.commands.next_due())
+            except queue.Empty:
+                self._run("command", self._send_commands, (self.commands.pop_due(),), self._on_sent)
+                continue
+            if job is None:
+                return
+            name, func, args, on_done = job
+            if func is None:
+                continue
+            self._run(name, func, args, on_done)
+            with self._lock:
+                self._pending[name] -= 1
+
+    def submit_to(self, executor, name, func, *args, on_done=None):
+        # Run func(*args) on another executor, for slow background work that must not queue up
+        # in front of the live jobs. It is not counted as pending; its result is applied like
+        # the result of any other job.
+        if self._stopping.is_set():
+            return None
+        return executor.submit(self._run, name, func, args, on_done)
+
+    def _run(self, name, func, args, on_done):
+        result = error = None
+        profiler = self.profiler
+        try:
+            result = func(*args) if profiler is None else profiler.call(name, func, *args)
+        except Exception as e:
+            error = e
+        if not self._stopping.is_set():
+            self.results.put((name, on_done, result, error))
+
+    def stop(self):
+        # Cancel the jobs and merged commands that did not start yet and tell the thread to
+        # finish after its current job
+        self._stopping.set()
+        cancelled = self.commands.clear()
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+                if job[1] is not None:
+                    cancelled += 1
+            except queue.Empty:
+                break
+        self.jobs.put(None)
+        return cancelled
 
 class RemehaHomeAPI:
     def __init__(self):
         # Initialize a session for making HTTP requests
-        self._session = requests.Session()
+        self.metrics = Metrics()
+        self.breakers = {name: CircuitBreaker(name, *settings) for name, settings in BREAKERS.items()}
+        self._breaker_status = None
+        # Set by onStop: no new login starts and multi-request work is abandoned between requests
+        self.stopping = threading.Event()
+        self._session = create_session(self.metrics)
+        self.options = {}
+        # Dashboard fast path: validators and fingerprint of the previous response
+        self._dashboard_etag = None
+        self._dashboard_last_modified = None
+        self._dashboard_fingerprint = None
+        self._last_dashboard = None
+        self._last_energy = None
+        self._energy_parts = {}
+        # Backfill history writes still to do and the checkpoint to save once they are done
+        self._backfill_writes = deque()
+        self._backfill_checkpoint = None
+        self._backfill_future = None
+        self._unconfirmed = {}
+        self.shared = None
+        self.profiler = None
+        self._energy_pool = ThreadPoolExecutor(max_workers=ENERGY_WORKERS + 1, thread_name_prefix="RemehaHomeEnergy")
+        self.energy_rate = EnergyRate()
+        self.dashboard_polls = 0
+        self.dashboard_unchanged = 0
         self.email = ""
         self.password = ""
+        # Keeps the access and refresh tokens between heartbeats
+        self.tokens = TokenManager(self)
+        self._fast_poll_until = 0
+        self._heating = False
+        self._heartbeat = None
 
     def onStart(self):
         # Called when the plugin is started
         Domoticz.Log("Remeha Home Plugin started.")
+        self._started = time.monotonic()
+        self._first_data = False
+        self._energy_waiting = False
         
         # Read options from Domoticz GUI
         self.readOptions()
-        # Check if there are no existing devices
-        if len(Devices) != 12:
-            # Example: Create devices for temperature, pressure, and setpoint
-            self.createDevices()
-        Domoticz.Heartbeat(5)
+        self.dashboard_table = compile_dashboard_table(DASHBOARD_FIELDS)
+        self.sample_table = compile_sample_table(SAMPLE_FIELDS)
+        self.energy_cache = EnergyCache(plugin_data_path("energy"))
+        self.state = StateStore(plugin_data_path("state"), self.email)
+        if "shared" in self.options:
+            if fcntl is None:
+                Domoticz.Error("The shared option needs file locking, which is not available on this system")
+            else:
+                self.shared = SharedCache(shared_cache_path(self.email))
+        self.tokens.load(self.state)
+        self.units = UnitMap(self.state)
+        self.samples = None
+        if "samples" in self.options:
+            days = SAMPLES_DAYS
+            if self.options["samples"] != "1":
+                try:
+                    days = int(self.options["samples"])
+                except ValueError:
+                    Domoticz.Error(f"Invalid value for option samples, keeping samples for {days} days")
+            try:
+                self.samples = SampleStore(plugin_data_path("samples", "db"), days)
+            except sqlite3.Error as e:
+                Domoticz.Error(f"Could not open the sample store: {e}")
+        global appliance_id
+        global climate_zone_id
+        appliance_id = self.units.primary.get("appliance")
+        climate_zone_id = self.units.primary.get("zone")
+        self.createDevices()
+        self.commands = CommandQueue(COMMAND_DEBOUNCE)
+        self.worker = Worker(self.commands, self._send_commands, self._commands_sent, self.profiler)
+        self.worker.start()
+        self.scheduler = Scheduler()
+        self.scheduler.schedule("dashboard", 0)
+        self.scheduler.schedule("energy", 0)
+        self._schedule_token_renewal()
+        self.scheduler.schedule("metrics", METRICS_INTERVAL)
+        self.scheduler.schedule("report", REPORT_INTERVAL)
+        if "backfill" in self.options:
+            self.scheduler.schedule("backfill", BACKFILL_INTERVAL)
+        if self.samples is not None:
+            self.scheduler.schedule("samples", SAMPLES_FLUSH)
+        # Login and the first dashboard and energy fetch start on the worker right away instead
+        # of at the first heartbeat; onStart itself does no network I/O
+        self._dispatch_due()
+        self._set_heartbeat()
         Domoticz.Log(f"Poll Interval: {self.poll_interval}")
 
     def onStop(self):
-        # Called when the plugin is stopped
+        # Called when the plugin is stopped. The worker gives up between requests, but a
+        # request already in flight runs until it is answered or times out, so the wait for
+        # the worker is bounded by STOP_TIMEOUT.
+        self.stopping.set()
+        cancelled = self.worker.stop()
+        if cancelled:
+            Domoticz.Log(f"Cancelled {cancelled} pending Remeha Home jobs and commands")
+        deadline = time.monotonic() + STOP_TIMEOUT
+        self.worker.join(STOP_TIMEOUT)
+        if self._backfill_future is not None:
+            wait([self._backfill_future], timeout=max(0, deadline - time.monotonic()))
+        if self.worker.is_alive() or (self._backfill_future is not None and not self._backfill_future.done()):
+            Domoticz.Error(f"Remeha Home requests still running after {STOP_TIMEOUT} seconds, not waiting for them")
+            self._energy_pool.shutdown(wait=False, cancel_futures=True)
+        else:
+            # The worker waited for its energy requests and the backfill is done, so the pool is idle
+            self._energy_pool.shutdown(wait=True)
+            if self.samples is not None:
+                self.samples.close()
+        self.cleanup()
         Domoticz.Log("Remeha Home Plugin stopped.")
 
     def readOptions(self):
@@ -62,29 +1364,52 @@ class RemehaHomeAPI:
             self.poll_interval = 30
         if self.poll_interval > 300:
             self.poll_interval = 300
+        self.options = parse_options(Parameters.get("Mode5", ""))
+        self.timeout = (
+            option_seconds(self.options, "connect_timeout", CONNECT_TIMEOUT),
+            option_seconds(self.options, "read_timeout", READ_TIMEOUT),
+        )
+        self.cycle_budget = option_seconds(self.options, "cycle_budget", CYCLE_BUDGET)
+        if "backfill" in self.options:
+            version = domoticz_version()
+            if version is None or version < BACKFILL_MIN_VERSION:
+                Domoticz.Error(
+                    f"Option backfill needs Domoticz {BACKFILL_MIN_VERSION[0]}.{BACKFILL_MIN_VERSION[1]} or newer, "
+                    f"running {Parameters.get('DomoticzVersion') or 'unknown version'}; backfill disabled"
+                )
+                del self.options["backfill"]
+        self.profiler = None
+        if "profile" in self.options:
+            every = PROFILE_EVERY
+            if self.options["profile"] != "1":
+                try:
+                    every = max(1, int(self.options["profile"]))
+                except ValueError:
+                    Domoticz.Error(f"Invalid value for option profile, sampling one in {every} calls")
+            self.profiler = Profiler(Parameters["HomeFolder"], every)
+        if hasattr(self, "worker"):
+            self.worker.profiler = self.profiler
+        touch_interval = int(Parameters.get("Mode4") or 15) * 60
+        if hasattr(self, "devices"):
+            self.devices.touch_interval = touch_interval
+        else:
+            self.devices = DeviceWriter(touch_interval)
 
     def createDevices(self):
-        # Declare Devices variable
-        global Devices
-
-        # Create devices for temperature, pressure, and setpoint
-        Domoticz.Device(Name="roomTemperature", Unit=1, TypeName="Temperature", Used=1).Create()
-        Domoticz.Device(Name="outdoorTemperature", Unit=2, TypeName="Temperature", Used=1).Create()
-        Domoticz.Device(Name="waterPressure", Unit=3, TypeName="Pressure", Used=1).Create()
-        Domoticz.Device(Name="setPoint", Unit=4, TypeName="Setpoint", Used=1).Create()
-        Domoticz.Device(Name="dhwTemperature", Unit=5, TypeName="Temperature", Used=1).Create()
-        Domoticz.Device(Name="EnergyConsumption", Unit=6, Type=243, TypeName="Kwh", Subtype=29, Used=1).Create()
-        Domoticz.Device(Name="gasCalorificValue", Unit=7, Type=243, Subtype=31, Used=1).Create()
-        Domoticz.Device(Name="zoneMode", Unit=8, TypeName="Selector Switch", Image=15, Options={"LevelNames":"Scheduling|Manual|TemporaryOverride|FrostProtection", "LevelOffHidden": "false", "SelectorStyle": "1"}, Used=1).Create()
-        Domoticz.Device(Name="waterPressureToLow", Unit=9, TypeName="Switch", Switchtype=0, Image=13, Used=1).Create()
-        Domoticz.Device(Name="EnergyDelivered", Unit=10, Type=243, TypeName="Kwh", Subtype=29, Switchtype=4, Used=1).Create()
-        Domoticz.Device(Name="Status", Unit=11, TypeName="Text", Image=15, Used=1).Create()
-        Domoticz.Device(Name="seasonalEfficiency", Unit=12, Type=243, Subtype=31, Used=1).Create()
-
-
+        # Create the devices of the dashboard mapping table, the energy devices and the optional
+        # metrics device that are missing; existing devices are left as they are
+        definitions = [(unit, device) for unit, device, *_ in DASHBOARD_FIELDS] + list(ENERGY_DEVICES)
+        if "metrics" in self.options:
+            definitions.append((METRICS_UNIT, dict(Name="API metrics", TypeName="Text", Image=15)))
+        for unit, device in sorted(definitions, key=lambda definition: definition[0]):
+            if unit not in Devices:
+                Domoticz.Device(Unit=unit, Used=1, **device).Create()
+                Domoticz.Log(f"Created device '{device['Name']}' (unit {unit})")
 
     def resolve_external_data(self):
         # Logic for resolving external data (OAuth2 flow)
+        # The session lives as long as the plugin, drop cookies of a previous login first
+        self._session.cookies.clear()
         random_state = secrets.token_urlsafe()
         code_challenge = secrets.token_urlsafe(64)
         code_challenge_sha256 = (
@@ -96,10 +1421,10 @@ class RemehaHomeAPI:
         )
 
         response = self._session.get(
-            "https://remehalogin.bdrthermea.net/bdrb2cprod.onmicrosoft.com/oauth2/v2.0/authorize",
+            f"{LOGIN_BASE_URL}/oauth2/v2.0/authorize",
             params={
                 "response_type": "code",
-                "client_id": "6ce007c6-0628-419e-88f4-bee2e6418eec",
+                "client_id": CLIENT_ID,
                 "redirect_uri": "com.b2c.remehaapp://login-callback",
                 "scope": "openid https://bdrb2cprod.onmicrosoft.com/iotdevice/user_impersonation offline_access",
                 "state": random_state,
@@ -112,12 +1437,16 @@ class RemehaHomeAPI:
                 "prompt": "login",
                 "signUp": "False",
             },
+            timeout=self.timeout,
         )
         response.raise_for_status()
 
         if response.status_code != 200:
             Domoticz.Error(f"Error received from server (authorize): {response.status_code}")
             return None
+        # The login takes four requests; give up between them when the plugin stops
+        if self.stopping.is_set():
+            return None
 
         request_id = response.headers["x-request-id"]
         state_properties_json = f'{{"TID":"{request_id}"}}'.encode("ascii")
@@ -132,12 +1461,12 @@ class RemehaHomeAPI:
             for cookie in self._session.cookies
             if (
                 cookie.name == "x-ms-cpim-csrf"
-                and cookie.domain == ".remehalogin.bdrthermea.net"
+                and cookie.domain.lstrip(".") == LOGIN_HOST
             )
         )
 
         response = self._session.post(
-            "https://remehalogin.bdrthermea.net/bdrb2cprod.onmicrosoft.com/B2C_1A_RPSignUpSignInNewRoomv3.1/SelfAsserted",
+            f"{LOGIN_BASE_URL}/B2C_1A_RPSignUpSignInNewRoomv3.1/SelfAsserted",
             params={
                 "tx": "StateProperties=" + state_properties,
                 "p": "B2C_1A_RPSignUpSignInNewRoomv3.1",
@@ -148,17 +1477,20 @@ class RemehaHomeAPI:
                 "signInName": self.email,
                 "password": self.password,
             },
+            timeout=self.timeout,
         )
         response.raise_for_status()
         
         if response.status_code != 200:
             Domoticz.Error(f"Error received from server (signin_1): {response.status_code}")
             return None
+        if self.stopping.is_set():
+            return None
 
         response_json = json.loads(response.text)
 
         response = self._session.get(
-            "https://remehalogin.bdrthermea.net/bdrb2cprod.onmicrosoft.com/B2C_1A_RPSignUpSignInNewRoomv3.1/api/CombinedSigninAndSignup/confirmed",
+            f"{LOGIN_BASE_URL}/B2C_1A_RPSignUpSignInNewRoomv3.1/api/CombinedSigninAndSignup/confirmed",
             params={
                 "rememberMe": "false",
                 "csrf_token": csrf_token,
@@ -166,6 +1498,7 @@ class RemehaHomeAPI:
                 "p": "B2C_1A_RPSignUpSignInNewRoomv3.1",
             },
             allow_redirects=False,
+            timeout=self.timeout,
         )
         response.raise_for_status()
 
@@ -182,405 +1515,819 @@ class RemehaHomeAPI:
             Domoticz.Error("Invalid response, check authorization")
             return None
         authorization_code = query_string_dict["code"]
+        if self.stopping.is_set():
+            return None
 
         grant_params = {
             "grant_type": "authorization_code",
             "code": authorization_code,
             "redirect_uri": "com.b2c.remehaapp://login-callback",
             "code_verifier": code_challenge,
-            "client_id": "6ce007c6-0628-419e-88f4-bee2e6418eec",
+            "client_id": CLIENT_ID,
         }
         return self._request_new_token(grant_params)
 
     def _request_new_token(self, grant_params):
         # Logic for requesting a new access token
         with self._session.post(
-            "https://remehalogin.bdrthermea.net/bdrb2cprod.onmicrosoft.com/oauth2/v2.0/token?p=B2C_1A_RPSignUpSignInNewRoomV3.1",
+            f"{LOGIN_BASE_URL}/oauth2/v2.0/token?p=B2C_1A_RPSignUpSignInNewRoomV3.1",
             data=grant_params,
             allow_redirects=True,
+            timeout=self.timeout,
         ) as response:
             if response.status_code != 200:
-                response_json = response.json()
-                Domoticz.Log(
-                    "OAuth2 token request returned '400 Bad Request': %s",
-                    response_json["error_description"],
-                )
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = None
+                description = body.get("error_description") if isinstance(body, dict) else None
+                Domoticz.Log(f"OAuth2 token request returned {response.status_code}: {description or response.text[:200]}")
             response.raise_for_status()
             response_json = response.json()
         return response_json
 
     def cleanup(self):
-        # Cleanup session resources
+        # Cleanup session resources, only called when the plugin stops
         self._session.close()
 
-    def update_devices(self, access_token):
-        # Update Domoticz devices with data from Remeha Home
+    def fetch_dashboard(self, access_token):
+        # Get the dashboard from Remeha Home, runs on the worker thread
         headers = {
             "Authorization": f"Bearer {access_token}",
-            "Ocp-Apim-Subscription-Key": "df605c5470d846fc91e848b1cc653ddf",
+            "Ocp-Apim-Subscription-Key": SUBSCRIPTION_KEY,
         }
-        
+        # Conditional request when the API handed out validators for the previous response
+        if self._dashboard_etag:
+            headers["If-None-Match"] = self._dashboard_etag
+        if self._dashboard_last_modified:
+            headers["If-Modified-Since"] = self._dashboard_last_modified
+        response = self._session.get(
+            f"{API_BASE_URL}/homes/dashboard", headers=headers, timeout=self.timeout
+        )
+        self.dashboard_polls += 1
+        if response.status_code == 304:
+            self.dashboard_unchanged += 1
+            return UNCHANGED
+        response.raise_for_status()
+        self._dashboard_etag = response.headers.get("ETag")
+        self._dashboard_last_modified = response.headers.get("Last-Modified")
+
+        # Otherwise skip parsing when the body is byte-for-byte the one of the previous poll
+        fingerprint = hashlib.sha1(response.content).digest()
+        if fingerprint == self._dashboard_fingerprint:
+            self.dashboard_unchanged += 1
+            return UNCHANGED
+        self._dashboard_fingerprint = fingerprint
+        return response.json()
+
+    def update_devices(self, response_json):
+        # Update Domoticz devices with the dashboard data from Remeha Home: every appliance,
+        # climate zone and hot water zone of the single dashboard response, in one pass over
+        # the precompiled mapping table
         global appliance_id
         global climate_zone_id
-        
-        # Initialize global variables if not already set
-        appliance_id = globals().get('appliance_id', None)
-        climate_zone_id = globals().get('climate_zone_id', None)
 
-        #Domoticz.Log("Getting device states...")
         try:
-            response = self._session.get(
-                "https://api.bdrthermea.net/Mobile/api/homes/dashboard", headers=headers
-            )
-
-            response.raise_for_status()
-
-            if response.status_code != 200:
-                Domoticz.Error(f"Error getting device states: {response.status_code}")
-                return None
+            heating = False
+            for appliance in response_json["appliances"]:
+                self._update_scope("appliance", appliance)
+                for zone in appliance.get("climateZones") or []:
+                    self._update_scope("zone", zone)
+                    heating = heating or zone.get("activeComfortDemand") not in (None, "Idle")
+                for hot_water in appliance.get("hotWaterZones") or []:
+                    self._update_scope("hot_water", hot_water)
+            self._heating = heating
 
-            response_json = response.json()
-            
-            # declaring value_dhwTemperature to not break if the value is not present.
-            value_dhwTemperature = None
-            
-            # Update Domoticz devices here based on the response_json
-            value_room_temperature = response_json["appliances"][0]["climateZones"][0]["roomTemperature"]
-            if response_json["appliances"][0]["capabilityOutdoorTemperature"] is True:
-                if response_json["appliances"][0]["outdoorTemperatureInformation"]["outdoorTemperatureSource"] == 'Wired':
-                    value_outdoor_temperature = response_json["appliances"][0]["outdoorTemperatureInformation"]["applianceOutdoorTemperature"]
-                    #Domoticz.Error(f"Device outdoor temp expected: {value_outdoor_temperature}")  
-                else :
-                    value_outdoor_temperature = response_json["appliances"][0]["outdoorTemperatureInformation"]["cloudOutdoorTemperature"]
-                    #Domoticz.Error(f"Internet temp expected : {value_outdoor_temperature}")
-
-            value_water_pressure = response_json["appliances"][0]["waterPressure"]
-            value_setpoint = response_json["appliances"][0]["climateZones"][0]["setPoint"]
-            value_gascalorificvalue = response_json["appliances"][0]["gasCalorificValue"]
-            value_zoneMode = response_json["appliances"][0]["climateZones"][0]["zoneMode"]
-            value_waterPressureOK = response_json["appliances"][0]["waterPressureOK"]
-            value_status = response_json["appliances"][0]["climateZones"][0]["activeComfortDemand"]
-            
-            # set globals
-            if climate_zone_id is None:
-                climate_zone_id = response_json["appliances"][0]["climateZones"][0]["climateZoneId"]            
-            if appliance_id is None:
-                appliance_id = response_json["appliances"][0]["applianceId"]
-            
-            try:
-                value_dhwTemperature = response_json["appliances"][0]["hotWaterZones"][0]["dhwTemperature"]
-            except:
-                pass
-
-            #if str(Devices[1].sValue) != str(value_room_temperature):
-            Devices[1].Update(nValue=0, sValue=str(value_room_temperature))
-            #if str(Devices[2].sValue) != str(value_outdoor_temperature):
-            if response_json["appliances"][0]["capabilityOutdoorTemperature"] is True:
-                Devices[2].Update(nValue=0, sValue=str(value_outdoor_temperature))
-            #if str(Devices[3].sValue) != str(value_water_pressure):
-            Devices[3].Update(nValue=0, sValue=str(value_water_pressure))
-            #if str(Devices[4].sValue) != str(value_setpoint):
-            Devices[4].Update(nValue=0, sValue=str(value_setpoint))
-            #if str(Devices[5].sValue) != str(value_dhwTemperature):
-            if value_dhwTemperature is not None:
-                Devices[5].Update(nValue=0, sValue=str(value_dhwTemperature))
-            #if str(Devices[7].sValue) != str(value_gascalorificvalue):
-            Devices[7].Update(nValue=0, sValue=str(value_gascalorificvalue), Options={"Custom": "1;kWh/m³"})
-            #if str(Devices[8].sValue) != str(value_zoneMode):
-            if value_zoneMode == "Scheduling":
-                Devices[8].Update(nValue=1, sValue="0")
-            elif value_zoneMode == "Manual":
-                Devices[8].Update(nValue=10, sValue="10")
-            elif value_zoneMode == "TemporaryOverride":
-                Devices[8].Update(nValue=20, sValue="20")
-            elif value_zoneMode == "FrostProtection":
-                Devices[8].Update(nValue=0, sValue="30")
-            #if str(Devices[9].sValue) != str(value_gascalorificvalue):
-            if value_waterPressureOK == True:
-                Devices[9].Update(nValue=0, sValue="Off")
-            else:
-                Devices[9].Update(nValue=1, sValue="On")
-            Devices[11].Update(nValue=0, sValue=str(value_status))
-        
+            # set globals: the primary appliance (energy) and climate zone
+            climate_zone_id = self.units.primary.get("zone")
+            appliance_id = self.units.primary.get("appliance")
+            self.state.update(appliance_id=appliance_id, climate_zone_id=climate_zone_id)
 
         except Exception as e:
-            Domoticz.Error(f"Error making GET request: {e}")
+            Domoticz.Error(f"Error processing dashboard data: {e}")
+
+    def _update_scope(self, scope, data):
+        id_key, name_key = SCOPE_KEYS[scope]
+        object_id = data.get(id_key)
+        if object_id is None:
+            return
+        for base_unit, accessor, options, device in self.dashboard_table.get(scope, ()):
+            values = accessor(data)
+            if values is None:
+                continue
+            if scope == "zone" and base_unit in (4, 8) and object_id in self._unconfirmed:
+                # Keep showing the state of a command that the dashboard does not reflect yet
+                continue
+            unit = self.units.unit(scope, object_id, base_unit)
+            if unit == 11 and self._breaker_status:
+                # The Status device shows the open breakers until they all closed again
+                continue
+            if unit not in Devices:
+                # Device of an additional appliance or zone, named after it
+                label = data.get(name_key) or str(object_id)[:8]
+                definition = dict(device, Name=f"{label} {device['Name']}")
+                Domoticz.Device(Unit=unit, Used=1, **definition).Create()
+                Domoticz.Log(f"Created device '{definition['Name']}' (unit {unit}) for {scope} {object_id}")
+            self.devices.update(unit, values[0], values[1], Options=options)
 
-    def set_temperature(self, access_token, room_temperature_setpoint):
+    def set_temperature(self, access_token, room_temperature_setpoint, zone_mode_level, zone_id):
         # Set temperature in the external system using a POST request
         headers = {
             'Authorization': f'Bearer {access_token}',
-            'Ocp-Apim-Subscription-Key': 'df605c5470d846fc91e848b1cc653ddf'
+            'Ocp-Apim-Subscription-Key': SUBSCRIPTION_KEY
         }
 
         try:
             json_data = {'roomTemperatureSetPoint': room_temperature_setpoint}
-            if Devices[8].sValue == "10": #If zonemode is manual then adjust the manual temp
+            if zone_mode_level == "10": #If zonemode is manual then adjust the manual temp
                 response = self._session.post(
-                    f'https://api.bdrthermea.net/Mobile/api/climate-zones/{climate_zone_id}/modes/manual',
+                    f'{API_BASE_URL}/climate-zones/{zone_id}/modes/manual',
                     headers=headers,
-                    json=json_data
+                    json=json_data,
+                    timeout=self.timeout
                     )
             else: # zonemode is not manual then temporary override
                 response = self._session.post(
-                    f'https://api.bdrthermea.net/Mobile/api/climate-zones/{climate_zone_id}/modes/temporary-override',
+                    f'{API_BASE_URL}/climate-zones/{zone_id}/modes/temporary-override',
                     headers=headers,
-                    json=json_data
+                    json=json_data,
+                    timeout=self.timeout
                     )
             response.raise_for_status()
             Domoticz.Log(f"Temperature set successfully to {room_temperature_setpoint}")
         except Exception as e:
             Domoticz.Error(f"Error making POST request: {e}")
+            self.breakers["command"].report(e)
+            return False
+        self.breakers["command"].success()
+        return True
     
+    def _fetch_energy_rows(self, url, headers):
+        # The data rows of an energyconsumption response
+        response = self._session.get(url, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["data"]
+
     def getDailyEnergyConsumption(self, access_token):
         headers = {
             'Authorization': f'Bearer {access_token}',
-            'Ocp-Apim-Subscription-Key': 'df605c5470d846fc91e848b1cc653ddf'
+            'Ocp-Apim-Subscription-Key': SUBSCRIPTION_KEY
             }
-        Domoticz.Log("Daily energy consumption updated")
+        base_url = f"{API_BASE_URL}/appliances/{appliance_id}/energyconsumption"
 
-        current_year = datetime.datetime.now().year
+        now = datetime.datetime.now()
+        current_year = now.year
+        current_month = now.month
 
-        # Step 1: Get all results of the previous years until the last day of the previous year
+        # Step 1: All previous years until the last day of the previous year. These never change,
+        # so they are only fetched once per year and otherwise taken from the cache.
+        years_period = f"years:{current_year - 1}"
         last_day_of_last_year = datetime.datetime(current_year - 1, 12, 31)
-        yearly_url = f"https://api.bdrthermea.net/Mobile/api/appliances/{appliance_id}/energyconsumption/yearly?startDate=1900-01-01T00:00:00.000Z&endDate={last_day_of_last_year.strftime('%Y-%m-%dT00:00:00.000Z')}"
-        
-        try:
-            yearly_data = requests.get(yearly_url, headers=headers).json()
-            
-            # Extract "heatingEnergyConsumed" from each row in the yearly response body
-            heating_energy_consumed_values_yearly = [entry["heatingEnergyConsumed"] for entry in yearly_data["data"]]
-            # Energy generated
-            heating_energy_delivered_values_yearly = [entry["heatingEnergyDelivered"] for entry in yearly_data["data"]]
-
-            # Calculate total heating energy consumed for yearly data
-            total_heating_energy_consumed_yearly = sum(heating_energy_consumed_values_yearly)
-            # Energy generated
-            total_heating_energy_delivered_yearly = sum(heating_energy_delivered_values_yearly)
-        except Exception as e:
-            print(f"Error making GET request: {e}")
+        # Step 2: The closed months of the current year, fetched once per month
+        months_period = f"months:{current_year}-{current_month - 1:02d}"
+        last_day_of_previous_month = datetime.datetime(current_year, current_month, 1) - datetime.timedelta(days=1)
+        # Step 3: The open month, this is the only part of the total that is fetched every time
+        open_month_period = f"{current_year}-{current_month:02d}"
+        last_day_of_current_month = calendar.monthrange(current_year, current_month)[1]
+        end_of_current_month = datetime.datetime(current_year, current_month, last_day_of_current_month)
+        # Step 4: Today
+        today_period = now.date().isoformat()
+        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        today_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
 
-        # Step 2: Get all results of the previous months excluding the current month
-        current_month = datetime.datetime.now().month
+        urls = {
+            "open_month": f"{base_url}/monthly?startDate={current_year}-{current_month:02d}-01T00:00:00.000Z&endDate={end_of_current_month.strftime('%Y-%m-%dT00:00:00.000Z')}",
+            "today": f"{base_url}/daily?startDate={today_start.strftime('%Y-%m-%dT%H:%M:%S.000Z')}&endDate={today_end.strftime('%Y-%m-%dT%H:%M:%S.999Z')}",
+        }
+        yearly = self.energy_cache.get(appliance_id, years_period)
+        if yearly is None:
+            urls["years"] = f"{base_url}/yearly?startDate=1900-01-01T00:00:00.000Z&endDate={last_day_of_last_year.strftime('%Y-%m-%dT00:00:00.000Z')}"
+        monthly = (0, 0)
+        if current_month > 1:
+            monthly = self.energy_cache.get(appliance_id, months_period)
+            if monthly is None:
+                urls["months"] = f"{base_url}/monthly?startDate={current_year}-01-01T00:00:00.000Z&endDate={last_day_of_previous_month.strftime('%Y-%m-%dT00:00:00.000Z')}"
 
-        # Get the last day of the current month
-        last_day_of_current_month = calendar.monthrange(current_year, current_month)[1]
+        # The requests are independent: run them side by side on the energy pool over the shared
+        # session, so the update takes about one round-trip
+        futures = {part: self._energy_pool.submit(self._fetch_energy_rows, url, headers) for part, url in urls.items()}
+        rows = {}
+        error = None
+        for part, future in futures.items():
+            if self.stopping.is_set():
+                # Parts that did not start yet are dropped, running ones finish or time out
+                future.cancel()
+                continue
+            try:
+                rows[part] = future.result()
+            except Exception as e:
+                Domoticz.Error(f"Error making GET request ({part}): {e}")
+                error = error or e
+        if self.stopping.is_set():
+            return None
+        self.breakers["energy"].report(error)
 
-        # Create a datetime object for the last day of the current month
-        end_of_current_month = datetime.datetime(current_year, current_month, last_day_of_current_month) 
-        
-        try:
-            monthly_url = f"https://api.bdrthermea.net/Mobile/api/appliances/{appliance_id}/energyconsumption/monthly?startDate={datetime.datetime.now().year}-01-01T00:00:00.000Z&endDate={end_of_current_month.strftime('%Y-%m-%dT00:00:00.000Z')}"
-            #print(monthly_url)
-            monthly_data = requests.get(monthly_url, headers=headers).json()
-      
-            # Extract "heatingEnergyConsumed" from each row in the monthly response body
-            heating_energy_consumed_values_monthly = [entry["heatingEnergyConsumed"] for entry in monthly_data["data"]]
-            # Energy generated
-            heating_energy_delivered_values_monthly = [entry["heatingEnergyDelivered"] for entry in monthly_data["data"]]
-
-            # Calculate total heating energy consumed for monthly data
-            total_heating_energy_consumed_monthly = sum(heating_energy_consumed_values_monthly)
-            # Energy delivered
-            total_heating_energy_delivered_monthly = sum(heating_energy_delivered_values_monthly)
-        except Exception as e:
-            print(f"Error making GET request: {e}")
-
-         # Combine the totals consumed
-        total_heating_energy_consumed = (
-        total_heating_energy_consumed_yearly +
-        total_heating_energy_consumed_monthly
-        ) 
-        # Generated
-        total_heating_energy_delivered = (
-        total_heating_energy_delivered_yearly +
-        total_heating_energy_delivered_monthly
-        ) 
-        
-        total_heating_energy_consumed = total_heating_energy_consumed * 1000
-        total_heating_energy_delivered = total_heating_energy_delivered * 1000
-        
-        
-        # Get the start and end date for today
-        today_start = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_end = datetime.datetime.now().replace(hour=23, minute=59, second=59, microsecond=999999)
-
-        # Format the start and end dates in the required format
-        today_string = today_start.strftime('%Y-%m-%dT%H:%M:%S.000Z')
-        end_of_today_string = today_end.strftime('%Y-%m-%dT%H:%M:%S.999Z')
-            
+        # Until 03:00 the API may still add to the last day of a closed month or year, so those
+        # are only cached once that day is settled
+        settled = now.hour not in (0, 1, 2)
         try:
-            response = requests.get(
-                f'https://api.bdrthermea.net/Mobile/api/appliances/{appliance_id}/energyconsumption/daily?startDate={today_string}&endDate={end_of_today_string}',
-                headers=headers
-            )
-            response_json = response.json()
-            
-            EnergyToday = response_json["data"][0]["heatingEnergyConsumed"]
-            
-            EnergyDeliveredToday = response_json["data"][0]["heatingEnergyDelivered"]
-            
-            # Initialize the variable to 1, default value if producerType is not "HeatPumpAirSource"
-            value_seasonalEfficiency = 1         
-            
-            # Iterate over the producers to find the matching producerType
-            for producer in response_json['data'][0]['producerPerformanceStatistics']['producers']:
-                if producer['producerType'] == "HeatPumpAirSource":
-                    value_seasonalEfficiency = producer['seasonalEfficiency']
-                    break  # Exit loop once the producer is found
-            
-            EnergyToday = EnergyToday * 1000
-            EnergyDeliveredToday = EnergyDeliveredToday * 1000
-            
-            # Split the string based on the semicolon
-            split_values = (Devices[6].sValue).split(";")
-            # Check the value before the semicolon against another string
-            DomoticzCurrentConsume = split_values[0]
-            
-            if datetime.datetime.now().hour not in (0, 1, 2):         
-                #if str(DomoticzCurrentConsume) != str(EnergyToday):
-                Devices[6].Update(nValue=0, sValue=str(EnergyToday) + ";" + str(total_heating_energy_consumed))
-                Devices[10].Update(nValue=0, sValue=str(EnergyDeliveredToday) + ";" + str(total_heating_energy_delivered))
-                Devices[12].Update(nValue=0, sValue=str(value_seasonalEfficiency), Options={"Custom": "1;SCOP"})
+            # A part that failed keeps its last known good value of the same month or day; after
+            # a month or day change the old value belongs to another period and there is no update
+            if "years" in rows:
+                yearly = self._sum_energy(rows["years"])
+                if settled:
+                    self.energy_cache.put(appliance_id, years_period, *yearly)
+            if "months" in rows:
+                monthly = self._sum_energy(rows["months"])
+                if settled:
+                    self.energy_cache.put(appliance_id, months_period, *monthly)
+            if "open_month" in rows:
+                self._energy_parts["open_month"] = (open_month_period, self._sum_energy(rows["open_month"]))
+            if "today" in rows:
+                self._energy_parts["today"] = (today_period, self._today_energy(rows["today"]))
         except Exception as e:
-            print(f"Error making GET request: {e}")
+            Domoticz.Error(f"Unexpected energy data: {e}")
+        open_month = self._energy_part("open_month", open_month_period)
+        today = self._energy_part("today", today_period)
+        if yearly is None or monthly is None or open_month is None or today is None:
+            return None
 
+        if not settled:
+            return None
+        return {
+            "consumed_today": today[0],
+            "consumed_total": (yearly[0] + monthly[0] + open_month[0]) * 1000,
+            "delivered_today": today[1],
+            "delivered_total": (yearly[1] + monthly[1] + open_month[1]) * 1000,
+            "seasonal_efficiency": today[2],
+        }
 
-    def check_token_validity(self,acces_token):
-        try:
-            # Extracting the payload part of the token
-            payload = acces_token.split('.')[1]
-            # Decoding the payload from base64
-            decoded_payload = base64.b64decode(payload + '===').decode('utf-8')
-            # Converting the decoded payload to a dictionary
-            payload_dict = eval(decoded_payload)
-        
-            # Extracting the expiration timestamp
-            expiration_timestamp = payload_dict.get('exp')
-            if expiration_timestamp:
-                #added 5 seconds to be certain that if the token expires in a few seconds a new one is fetched
-                current_timestamp = datetime.datetime.now().timestamp() + 5
-                if current_timestamp < expiration_timestamp:
-                    return "valid"
-                else:
-                    Domoticz.Log("Token check: Token is invalid, getting new token.....")
-                    return "invalid"
-            else:
-                Domoticz.Log("Token check: Token is invalid, getting new token.....")
-                return "invalid"  # If expiration timestamp is not present, consider it invalid
-        except Exception as e:
-            print("Error:", e)
-        return "invalid"
-    
-    def zonemode(self, access_token, level):
+    def _energy_part(self, part, period):
+        # The cached value of an energy part, only when it is of the given month or day
+        cached = self._energy_parts.get(part)
+        if cached is None or cached[0] != period:
+            return None
+        return cached[1]
+
+    def _sum_energy(self, data):
+        # Sum heatingEnergyConsumed and heatingEnergyDelivered over all rows
+        consumed = sum(entry["heatingEnergyConsumed"] for entry in data)
+        delivered = sum(entry["heatingEnergyDelivered"] for entry in data)
+        return consumed, delivered
+
+    def _today_energy(self, data):
+        # Energy consumed and delivered today in Wh and the seasonal efficiency
+        EnergyToday = data[0]["heatingEnergyConsumed"] * 1000
+        EnergyDeliveredToday = data[0]["heatingEnergyDelivered"] * 1000
+
+        # Initialize the variable to 1, default value if producerType is not "HeatPumpAirSource"
+        value_seasonalEfficiency = 1
+
+        # Iterate over the producers to find the matching producerType
+        for producer in data[0]['producerPerformanceStatistics']['producers']:
+            if producer['producerType'] == "HeatPumpAirSource":
+                value_seasonalEfficiency = producer['seasonalEfficiency']
+                break  # Exit loop once the producer is found
+        return EnergyToday, EnergyDeliveredToday, value_seasonalEfficiency
+
+    def update_energy_devices(self, energy):
+        # Update the energy devices with the result of getDailyEnergyConsumption
+        if energy is None:
+            return
+        self._last_energy = energy
+        # The power part of the kWh devices is estimated from the change of today's energy
+        now = time.monotonic()
+        self.energy_rate.add(now, energy["consumed_today"], energy["delivered_today"])
+        consumed_power, delivered_power = self.energy_rate.power(now)
+        self.devices.update(6, 0, f"{consumed_power:.0f};{energy['consumed_total']}")
+        self.devices.update(10, 0, f"{delivered_power:.0f};{energy['delivered_total']}")
+        self.devices.update(12, 0, energy["seasonal_efficiency"], Options={"Custom": "1;SCOP"})
+        # Without consumption there is no COP; show 0 instead of the value of the last run
+        cop = delivered_power / consumed_power if consumed_power > 0 else 0
+        self.devices.update(COP_UNIT, 0, f"{cop:.2f}")
+        Domoticz.Log("Daily energy consumption updated")
+
+
+    def zonemode(self, access_token, level, current_setpoint, zone_id):
         headers = {
             'Authorization': f'Bearer {access_token}',
-            'Ocp-Apim-Subscription-Key': 'df605c5470d846fc91e848b1cc653ddf'
+            'Ocp-Apim-Subscription-Key': SUBSCRIPTION_KEY
             }
         try:
             if level == 0: # Scheduling mode
                 json_data = {"heatingProgramId": 1}
-                response = requests.post(
-                    f'https://api.bdrthermea.net/Mobile/api/climate-zones/{climate_zone_id}/modes/schedule',
+                response = self._session.post(
+                    f'{API_BASE_URL}/climate-zones/{zone_id}/modes/schedule',
                     headers=headers,
-                    json=json_data
+                    json=json_data,
+                    timeout=self.timeout
                     )
                 response.raise_for_status()
                 Domoticz.Log("Zonemode succesfully set to Scheduling")
             elif level == 10: # Manual mode
-                room_temperature_setpoint = float(Devices[4].sValue)
+                room_temperature_setpoint = float(current_setpoint)
                 json_data = {"roomTemperatureSetPoint": room_temperature_setpoint}
-                response = requests.post(
-                    f'https://api.bdrthermea.net/Mobile/api/climate-zones/{climate_zone_id}/modes/manual',
+                response = self._session.post(
+                    f'{API_BASE_URL}/climate-zones/{zone_id}/modes/manual',
                     headers=headers,
-                    json=json_data
+                    json=json_data,
+                    timeout=self.timeout
                     )
                 response.raise_for_status()
                 Domoticz.Log("Zonemode succesfully set to Manual")
             elif level == 20: # TemporaryOverride mode
-                room_temperature_setpoint = float(Devices[4].sValue)
+                room_temperature_setpoint = float(current_setpoint)
                 json_data = {'roomTemperatureSetPoint': room_temperature_setpoint}
                 response = self._session.post(
-                    f'https://api.bdrthermea.net/Mobile/api/climate-zones/{climate_zone_id}/modes/temporary-override',
+                    f'{API_BASE_URL}/climate-zones/{zone_id}/modes/temporary-override',
                     headers=headers,
-                    json=json_data
+                    json=json_data,
+                    timeout=self.timeout
                     )
                 response.raise_for_status()
                 Domoticz.Log("Zonemode succesfully set to TemporaryOverride")
             elif level == 30: # FrostProtection mode
                 response = self._session.post(
-                    f'https://api.bdrthermea.net/Mobile/api/climate-zones/{climate_zone_id}/modes/anti-frost',
-                    headers=headers
+                    f'{API_BASE_URL}/climate-zones/{zone_id}/modes/anti-frost',
+                    headers=headers,
+                    timeout=self.timeout
                     )   
                 response.raise_for_status()
                 Domoticz.Log("Zonemode succesfully set to FrostProtection")
-                
+
         except Exception as e:
-                print("Error:", e)
-                return "invalid"
+            Domoticz.Error(f"Error making POST request: {e}")
+            self.breakers["command"].report(e)
+            return False
+        self.breakers["command"].success()
+        return True
     
     def onheartbeat(self):
-        # Heartbeat function called periodically
-        Domoticz.Heartbeat(self.poll_interval)
-        Domoticz.Log("Remeha Home plugin heartbeat")
-        current_time_minutes = time.localtime().tm_min
-        
-        # Check if the access token exists in the instance variable self and if it's valid
-        access_token = getattr(self, 'access_token', None)
-        if access_token and self.check_token_validity(access_token) == "valid":
-            try:
-                self.update_devices(access_token)
-                # Check if the current time in minutes is 5, then get the daily energy consumption
-                # The API seems to be only updated once an hour so no use to run it more often.
-                if current_time_minutes == 5:
-                    self.getDailyEnergyConsumption(access_token)
-            except Exception as e:
-                Domoticz.Error(f"Error making POST request: {e}")
+        # Heartbeat function called periodically. It never does network I/O itself: finished
+        # worker results are applied to the devices and overdue tasks are handed to the worker.
+        self._apply_results()
+        self._write_backfill()
+        self._dispatch_due()
+        self._update_breaker_status()
+        self._set_heartbeat()
+
+    def _dispatch_due(self):
+        # Hand the tasks whose deadline passed to the worker, or run them when they are cheap.
+        # Secondary work handed out in this cycle has to start before the cycle deadline
+        cycle_deadline = time.monotonic() + self.cycle_budget
+        for task in self.scheduler.due():
+            if task == "dashboard":
+                Domoticz.Log("Remeha Home plugin heartbeat")
+                self.worker.submit("dashboard", self._poll_dashboard, on_done=self._dashboard_done, unique=True)
+                self.scheduler.schedule("dashboard", self._poll_delay())
+            elif task == "energy":
+                if globals().get('appliance_id') is None:
+                    # The appliance is only known after the first dashboard poll, which starts it
+                    self._energy_waiting = True
+                    self.scheduler.schedule("energy", FAST_POLL_INTERVAL)
+                    continue
+                self.worker.submit("energy", self._poll_energy, cycle_deadline, on_done=self._energy_done, unique=True)
+                self.scheduler.schedule("energy", seconds_until_minute(ENERGY_MINUTE))
+            elif task == "token":
+                self.worker.submit("token", self.tokens.get_access_token, True, on_done=self._token_done, unique=True)
+            elif task == "metrics":
+                if "metrics" in self.options:
+                    self.devices.update(METRICS_UNIT, 0, self.metrics.report())
+                self.scheduler.schedule("metrics", METRICS_INTERVAL)
+            elif task == "report":
+                Domoticz.Log(self.devices.report())
+                if self.dashboard_polls:
+                    Domoticz.Log(
+                        f"Dashboard unchanged in {self.dashboard_unchanged} of {self.dashboard_polls} polls since start "
+                        f"({100 * self.dashboard_unchanged / self.dashboard_polls:.0f}%)"
+                    )
+                Domoticz.Log(f"API metrics: {self.metrics.report()}")
+                self.scheduler.schedule("report", REPORT_INTERVAL)
+            elif task == "backfill":
+                self._next_backfill()
+            elif task == "samples":
+                # The batched insert is disk I/O, it runs on the worker
+                self.worker.submit("samples", self.samples.flush, unique=True)
+                self.scheduler.schedule("samples", SAMPLES_FLUSH)
+
+    def _update_breaker_status(self):
+        # Show open breakers in the Status device; once they all closed again the dashboard
+        # value is restored
+        states = [breaker.describe() for breaker in self.breakers.values()]
+        status = ", ".join(state for state in states if state)
+        if status == self._breaker_status:
+            return
+        self._breaker_status = status
+        if status:
+            self.devices.update(11, 0, f"Cloud unavailable: {status}")
+        elif self._last_dashboard is not None:
+            self.update_devices(self._last_dashboard)
+
+    def _poll_delay(self):
+        # Poll faster shortly after a command or while heating, slower when idle
+        if self._heating or time.monotonic() < self._fast_poll_until:
+            return min(FAST_POLL_INTERVAL, self.poll_interval)
+        return min(self.poll_interval * 2, max(IDLE_POLL_MAX, self.poll_interval))
+
+    def _set_heartbeat(self):
+        # Wake up at the nearest deadline, or soon when the worker has results on the way or
+        # backfill history is still to be written
+        if self.worker.busy() or self._backfill_writes:
+            interval = 1
         else:
-            # Access token is expired or doesn't exist in the session, get a new one
-            result = self.resolve_external_data()
-            if result is not None:
-                try:
-                    access_token = result.get("access_token")
-                    # Save the access token to the session
-                    self.access_token = access_token
-                    self.update_devices(access_token)
-                    # Check if the current time in minutes is 5, then get the daily energy consumption
-                    # The API seems to be only updated once an hour so no use to run it more often.
-                    if current_time_minutes == 5:
-                        self.getDailyEnergyConsumption(access_token)
-                except Exception as e:
-                    Domoticz.Error(f"Error making POST request: {e}")
-        self.cleanup()
+            deadline = self.scheduler.next_deadline()
+            interval = MAX_HEARTBEAT if deadline is None else int(min(max(deadline, 1), MAX_HEARTBEAT))
+        if interval != self._heartbeat:
+            self._heartbeat = interval
+            Domoticz.Heartbeat(interval)
 
-    def oncommand(self, unit, command, level, hue):
-        # Command handling function
-        access_token = getattr(self, 'access_token', None)
-        if access_token and self.check_token_validity(access_token) == "valid":
+    def _schedule_token_renewal(self):
+        expires_at = self.tokens.expires_at()
+        if expires_at is not None:
+            self.scheduler.schedule("token", expires_at - time.time() - TOKEN_RENEW_MARGIN)
+
+    def _token_done(self, access_token):
+        if access_token is None:
+            self.scheduler.schedule("token", FAST_POLL_INTERVAL)
+        else:
+            self._schedule_token_renewal()
+
+    def _poll_dashboard(self):
+        # Worker thread: get a valid access token and the dashboard
+        access_token = self.tokens.get_access_token()
+        if access_token is None:
+            return None
+        # Confirming a command needs a fresh dashboard, not the one of another instance
+        if self.shared is None or self._unconfirmed or time.monotonic() < self._fast_poll_until:
+            return self._fetch_dashboard_checked(access_token)
+        with self.shared.locked() as data:
+            entry = data.get("dashboard")
+            if isinstance(entry, dict) and time.time() - entry.get("time", 0) < self.poll_interval:
+                # Another instance polled within the poll interval
+                fingerprint = bytes.fromhex(entry["fingerprint"])
+                if fingerprint == self._dashboard_fingerprint:
+                    return UNCHANGED
+                self._dashboard_fingerprint = fingerprint
+                return entry["dashboard"]
+            dashboard = self._fetch_dashboard_checked(access_token)
+            body = self._last_dashboard if dashboard is UNCHANGED else dashboard
+            if body is not None and self._dashboard_fingerprint is not None:
+                data["dashboard"] = {"time": time.time(), "fingerprint": self._dashboard_fingerprint.hex(), "dashboard": body}
+            return dashboard
+
+    def _fetch_dashboard_checked(self, access_token):
+        # The breaker is only asked right before the call, so a half-open probe always reports back
+        breaker = self.breakers["dashboard"]
+        if not breaker.allow():
+            return None
+        try:
+            dashboard = self.fetch_dashboard(access_token)
+        except Exception as e:
+            breaker.report(e)
+            raise
+        breaker.success()
+        return dashboard
+
+    def _dashboard_done(self, dashboard):
+        # Plugin thread: apply the dashboard and keep the token renewal planned. An unchanged
+        # dashboard is only applied again when devices have to be touched against timeouts.
+        if dashboard is not None and self._unconfirmed:
+            confirming = self._last_dashboard if dashboard is UNCHANGED else dashboard
+            if confirming is not None:
+                self._confirm_commands(confirming)
+        if dashboard is UNCHANGED:
+            if self._last_dashboard is not None and self.devices.touch_due():
+                self.update_devices(self._last_dashboard)
+        elif dashboard is not None:
+            self._last_dashboard = dashboard
+            self.update_devices(dashboard)
+            if not self._first_data:
+                self._first_data = True
+                Domoticz.Log(f"First data from Remeha Home {time.monotonic() - self._started:.1f} seconds after start")
+            if self._energy_waiting and globals().get('appliance_id') is not None:
+                self._energy_waiting = False
+                self.scheduler.schedule("energy", 0)
+        if dashboard is not None and self.samples is not None and self._last_dashboard is not None:
+            self._add_samples(self._last_dashboard)
+        if not self.scheduler.scheduled("token"):
+            self._schedule_token_renewal()
+
+    def _add_samples(self, dashboard):
+        # Buffer the values of every appliance, climate zone and hot water zone of this poll
+        now = time.time()
+        for appliance in dashboard.get("appliances") or []:
+            objects = [("appliance", appliance)]
+            objects += [("zone", zone) for zone in appliance.get("climateZones") or []]
+            objects += [("hot_water", hot_water) for hot_water in appliance.get("hotWaterZones") or []]
+            for scope, data in objects:
+                object_id = data.get(SCOPE_KEYS[scope][0])
+                if object_id is None:
+                    continue
+                for name, accessor in self.sample_table.get(scope, ()):
+                    value = accessor(data)
+                    if value is not None:
+                        self.samples.add(now, object_id, name, value)
+
+    def _poll_energy(self, cycle_deadline):
+        # Worker thread: get a valid access token and the energy data, unless the login and
+        # dashboard calls of this cycle already used up the time budget
+        if time.monotonic() > cycle_deadline:
+            return DEFERRED
+        access_token = self.tokens.get_access_token()
+        if access_token is None:
+            return None
+        if time.monotonic() > cycle_deadline:
+            return DEFERRED
+        if self.shared is None:
+            return self._fetch_energy_checked(access_token)
+        with self.shared.locked() as data:
+            entry = data.get("energy")
+            if (
+                isinstance(entry, dict)
+                and entry.get("appliance") == appliance_id
+                and time.time() - entry.get("time", 0) < SHARED_ENERGY_AGE
+            ):
+                return entry["energy"]
+            energy = self._fetch_energy_checked(access_token)
+            if energy is not None:
+                data["energy"] = {"time": time.time(), "appliance": appliance_id, "energy": energy}
+            return energy
+
+    def _fetch_energy_checked(self, access_token):
+        # getDailyEnergyConsumption reports every call to the breaker, so a probe taken here is released
+        if not self.breakers["energy"].allow():
+            return None
+        return self.getDailyEnergyConsumption(access_token)
+
+    def _energy_done(self, energy):
+        if energy is DEFERRED:
+            Domoticz.Log("Remeha Home cloud is slow, energy update deferred to the next poll")
+            self.scheduler.schedule("energy", self._poll_delay())
+            return
+        self.update_energy_devices(energy)
+
+    def _backfill_earliest(self):
+        # First day to backfill: the date given with the backfill option, otherwise everything
+        # the API still has
+        value = self.options.get("backfill", "1")
+        if value == "1":
+            return datetime.date.min
+        try:
+            return datetime.date.fromisoformat(value)
+        except ValueError:
+            Domoticz.Error(f"Invalid backfill date {value}, expected YYYY-MM-DD")
+            return datetime.date.min
+
+    def _next_backfill(self):
+        # Plugin thread: hand the next chunk of the energy backfill to the energy pool. The backfill
+        # walks back from yesterday; the checkpoint in the state file holds the next day to
+        # fetch and the meter readings at the end of that day, so it resumes after a restart.
+        checkpoint = self.state.get("backfill")
+        if not isinstance(checkpoint, dict) or checkpoint.get("appliance") != appliance_id:
+            if appliance_id is None or self._last_energy is None:
+                # The meter readings to count back from are known after the first energy update
+                self.scheduler.schedule("backfill", BACKFILL_INTERVAL)
+                return
+            checkpoint = {
+                "appliance": appliance_id,
+                "next": (datetime.date.today() - datetime.timedelta(days=1)).isoformat(),
+                "consumed": self._last_energy["consumed_total"] - self._last_energy["consumed_today"],
+                "delivered": self._last_energy["delivered_total"] - self._last_energy["delivered_today"],
+                "days": 0,
+                "done": False,
+            }
+            self.state.update(backfill=checkpoint)
+            Domoticz.Log("Energy backfill started")
+        if checkpoint["done"]:
+            return
+        # Live polling goes first: only fetch when the worker is idle and the energy API is up
+        if self.worker.pending() or self.breakers["energy"].state != "closed":
+            self.scheduler.schedule("backfill", BACKFILL_INTERVAL)
+            return
+        end = datetime.date.fromisoformat(checkpoint["next"])
+        start = max(end - datetime.timedelta(days=BACKFILL_CHUNK_DAYS - 1), self._backfill_earliest())
+        # The chunk request can take up to the read timeout; on the energy pool it does not
+        # delay the dashboard polls and commands behind it on the worker
+        self._backfill_future = self.worker.submit_to(
+            self._energy_pool, "backfill", self._fetch_backfill, start, end, on_done=self._backfill_done
+        )
+
+    def _fetch_backfill(self, start, end):
+        # Energy pool thread: the daily energy rows of start..end
+        access_token = self.tokens.get_access_token()
+        if access_token is None:
+            return None
+        headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Ocp-Apim-Subscription-Key': SUBSCRIPTION_KEY
+            }
+        try:
+            response = self._session.get(
+                f"{API_BASE_URL}/appliances/{appliance_id}/energyconsumption/daily"
+                f"?startDate={start.isoformat()}T00:00:00.000Z&endDate={end.isoformat()}T23:59:59.999Z",
+                headers=headers,
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            rows = response.json()["data"]
+        except Exception as e:
+            Domoticz.Error(f"Error making GET request: {e}")
+            self.breakers["energy"].report(e)
+            return None
+        self.breakers["energy"].success()
+        return start, end, rows
+
+    def _backfill_done(self, result):
+        # Plugin thread: queue the fetched days for the history of the kWh devices, newest
+        # first, counting the meter readings back by the energy of each day. The heartbeats
+        # write them BACKFILL_WRITES at a time.
+        if result is None:
+            self.scheduler.schedule("backfill", BACKFILL_INTERVAL)
+            return
+        start, end, rows = result
+        checkpoint = dict(self.state.get("backfill"))
+        days = {row["timeStamp"][:10]: row for row in rows}
+        consumed = checkpoint["consumed"]
+        delivered = checkpoint["delivered"]
+        day = end
+        while rows and day >= start and consumed > 0:
+            row = days.get(day.isoformat(), {})
+            consumed_day = row.get("heatingEnergyConsumed", 0) * 1000
+            delivered_day = row.get("heatingEnergyDelivered", 0) * 1000
+            self._backfill_writes.append((6, f"{consumed_day:.0f};{consumed:.0f};{day.isoformat()}"))
+            self._backfill_writes.append((10, f"{delivered_day:.0f};{delivered:.0f};{day.isoformat()}"))
+            consumed -= consumed_day
+            delivered -= delivered_day
+            checkpoint["days"] += 1
+            day -= datetime.timedelta(days=1)
+        # Done at the requested first day, before the first day the API has data for, or when
+        # the meter reading is counted back to zero
+        checkpoint.update(
+            next=day.isoformat(),
+            consumed=consumed,
+            delivered=delivered,
+            done=not rows or consumed <= 0 or start <= self._backfill_earliest(),
+        )
+        self._backfill_checkpoint = (checkpoint, start)
+
+    def _write_backfill(self):
+        # Plugin thread: write the next queued history values; the checkpoint is only saved
+        # once the whole chunk is written, so a restart fetches an unfinished chunk again
+        for _ in range(min(BACKFILL_WRITES, len(self._backfill_writes))):
+            self.devices.history(*self._backfill_writes.popleft())
+        if self._backfill_writes or self._backfill_checkpoint is None:
+            return
+        checkpoint, start = self._backfill_checkpoint
+        self._backfill_checkpoint = None
+        self.state.update(backfill=checkpoint)
+        if checkpoint["done"]:
+            Domoticz.Log(f"Energy backfill complete, {checkpoint['days']} days written")
+        else:
+            Domoticz.Log(f"Energy backfill: history written back to {start.isoformat()}")
+            self.scheduler.schedule("backfill", BACKFILL_INTERVAL)
+
+    def _apply_results(self):
+        # Run the completion callbacks of finished worker jobs on the plugin thread. A job that
+        # raised is finished like one without a result, so its callback still plans the next run.
+        while True:
             try:
-                if unit == 4:  # setpoint device
-                    if command == 'Set Level':
-                        room_temperature_setpoint = float(level)
-                        self.set_temperature(access_token, room_temperature_setpoint)
-                elif unit == 8: # zonemode device
-                    self.zonemode(access_token, level)
-            except Exception as e:
-                Domoticz.Error(f"Error making POST request: {e}")
+                name, on_done, result, error = self.worker.results.get_nowait()
+            except queue.Empty:
+                return
+            if error is not None:
+                Domoticz.Error(f"Error in {name}: {error}")
+                result = None
+            if on_done is not None:
+                on_done(result)
+
+    def oncommand(self, unit, command, level, hue):
+        # Command handling function. Commands are routed to the climate zone the device belongs
+        # to, merged per zone and sent by the worker
+        owner = self.units.owner(unit, "zone", (4, 8))
+        if owner is None or owner[0] is None:
+            Domoticz.Error(f"Command for unit {unit} ignored, its climate zone is not known yet")
+            return
+        zone_id, base_unit = owner
+        setpoint_unit = self.units.unit("zone", zone_id, 4)
+        zone_mode_unit = self.units.unit("zone", zone_id, 8)
+        zone_mode_state = Devices[zone_mode_unit].sValue if zone_mode_unit in Devices else None
+        setpoint_state = Devices[setpoint_unit].sValue if setpoint_unit in Devices else None
+        if base_unit == 4 and command == 'Set Level':  # setpoint device
+            self.commands.add(zone_id, setpoint=float(level), zone_mode_state=zone_mode_state, setpoint_state=setpoint_state)
+        elif base_unit == 8: # zonemode device
+            self.commands.add(zone_id, mode=level, zone_mode_state=zone_mode_state, setpoint_state=setpoint_state)
         else:
-             # Access token is expired or doesn't exist in the session, get a new one
-            result = self.resolve_external_data()
-            if result is not None:
-                try:
-                    access_token = result.get("access_token")
-                    # Save the access token to the session
-                    self.access_token = access_token
-                    if unit == 4:  # setpoint device
-                        if command == 'Set Level':
-                            room_temperature_setpoint = float(level)
-                            self.set_temperature(access_token, room_temperature_setpoint)
-                except Exception as e:
-                    Domoticz.Error(f"Error making POST request: {e}")
-        self.cleanup()
+            return
+        self.worker.wake()
+        # Poll faster for a while so the result of the command shows up quickly
+        self._fast_poll_until = time.monotonic() + FAST_POLL_PERIOD
+        self.scheduler.schedule_before("dashboard", COMMAND_DEBOUNCE + 5)
+        self._set_heartbeat()
+
+    def _send_commands(self, intents):
+        # Worker thread: send the final intent of each climate zone with as few POSTs as possible.
+        # Intents that failed because the cloud is down are kept and retried after the backoff window.
+        # Returns the state each sent command should lead to, as (zone id, setpoint, zone mode,
+        # time the first command was given); None means the command leaves that value to the API.
+        sent_commands = []
+        if not intents:
+            return sent_commands
+        # Without a token the command breaker is not asked at all: a probe taken here would
+        # never be reported and keep the breaker half-open
+        access_token = self.tokens.get_access_token()
+        breaker = self.breakers["command"]
+        if access_token is None or not breaker.allow():
+            self._retry_commands(intents)
+            return sent_commands
+        for index, (zone_id, intent) in enumerate(intents):
+            if self.stopping.is_set():
+                Domoticz.Log(f"Remeha Home plugin stopping, {len(intents) - index} command(s) not sent")
+                break
+            mode = intent["mode"]
+            setpoint = intent["setpoint"]
+            if mode is None:
+                sent = self.set_temperature(access_token, setpoint, intent["zone_mode_state"], zone_id)
+                expected = (setpoint, "Manual" if intent["zone_mode_state"] == "10" else "TemporaryOverride")
+            elif setpoint is None or (mode in (0, 30) and not intent["setpoint_last"]):
+                sent = self.zonemode(access_token, mode, intent["setpoint_state"], zone_id)
+                # Scheduling and FrostProtection take the setpoint from the schedule
+                expected_setpoint = float(intent["setpoint_state"]) if mode in (10, 20) else None
+                expected = (expected_setpoint, ZONE_MODE_NAMES.get(mode))
+            elif mode in (10, 20):
+                # Manual and TemporaryOverride take the setpoint in the same POST
+                sent = self.zonemode(access_token, mode, setpoint, zone_id)
+                expected = (setpoint, ZONE_MODE_NAMES[mode])
+            else:
+                # Setpoint changed after switching to Scheduling/FrostProtection: a temporary override
+                sent = self.set_temperature(access_token, setpoint, str(mode), zone_id)
+                expected = (setpoint, "TemporaryOverride")
+            if not sent and breaker.failures:
+                self._retry_commands([(zone_id, intent)])
+                continue
+            if sent:
+                sent_commands.append((zone_id, *expected, intent["received"]))
+            if intent["count"] > 1:
+                Domoticz.Log(
+                    f"Merged {intent['count']} commands into one for climate zone {zone_id}, "
+                    f"{self.commands.saved} POSTs saved since start"
+                )
+        return sent_commands
+
+    def _commands_sent(self, sent_commands):
+        # Plugin thread: show the expected state right away instead of waiting for the next poll,
+        # and poll quickly until the dashboard confirms it
+        for zone_id, setpoint, mode, received in sent_commands or ():
+            setpoint_unit = self.units.unit("zone", zone_id, 4)
+            zone_mode_unit = self.units.unit("zone", zone_id, 8)
+            if setpoint is not None:
+                self.devices.update(setpoint_unit, 0, str(setpoint))
+            if mode is not None:
+                self.devices.update(zone_mode_unit, *ZONE_MODE_LEVELS[mode])
+            self._unconfirmed[zone_id] = {"setpoint": setpoint, "mode": mode, "received": received, "polls": 0}
+        if self._unconfirmed:
+            self.scheduler.schedule_before("dashboard", CONFIRM_INTERVAL)
+
+    def _confirm_commands(self, dashboard):
+        # Plugin thread: compare the optimistic state with the dashboard. A command is confirmed
+        # when its zone shows the expected setpoint and zone mode; after CONFIRM_POLLS polls
+        # without that the devices are rolled back to what the dashboard shows.
+        zones = {
+            zone.get("climateZoneId"): zone
+            for appliance in dashboard.get("appliances") or []
+            for zone in appliance.get("climateZones") or []
+        }
+        rolled_back = False
+        for zone_id, expected in list(self._unconfirmed.items()):
+            zone = zones.get(zone_id, {})
+            setpoint_ok = expected["setpoint"] is None or (
+                isinstance(zone.get("setPoint"), (int, float)) and abs(zone["setPoint"] - expected["setpoint"]) < 0.05
+            )
+            mode_ok = expected["mode"] is None or zone.get("zoneMode") == expected["mode"]
+            if setpoint_ok and mode_ok:
+                del self._unconfirmed[zone_id]
+                Domoticz.Log(
+                    f"Command for climate zone {zone_id} confirmed "
+                    f"{time.monotonic() - expected['received']:.1f} seconds after it was given"
+                )
+                continue
+            expected["polls"] += 1
+            if expected["polls"] >= CONFIRM_POLLS:
+                del self._unconfirmed[zone_id]
+                Domoticz.Error(
+                    f"Command for climate zone {zone_id} not confirmed after {expected['polls']} polls, "
+                    f"showing the state reported by Remeha Home"
+                )
+                rolled_back = True
+        if rolled_back:
+            self.update_devices(dashboard)
+        if self._unconfirmed:
+            self.scheduler.schedule_before("dashboard", CONFIRM_INTERVAL)
+
+    def _retry_commands(self, intents):
+        delay = max(self.breakers["command"].retry_in(), self.breakers["login"].retry_in(), COMMAND_DEBOUNCE)
+        for zone_id, intent in intents:
+            self.commands.requeue(zone_id, intent, delay)
+        Domoticz.Log(f"Remeha Home cloud unavailable, retrying {len(intents)} command(s) in {delay:.0f} seconds")
 
 # Create an instance of the RemehaHomeAPI class
 _plugin = RemehaHomeAPI()
@@ -592,10 +2339,16 @@ def onStop():
     _plugin.onStop()
 
 def onHeartbeat():
-    _plugin.onheartbeat()
+    if _plugin.profiler is None:
+        _plugin.onheartbeat()
+    else:
+        _plugin.profiler.call("onHeartbeat", _plugin.onheartbeat)
 
 def onCommand(unit, command, level, hue):
-    _plugin.oncommand(unit, command, level, hue)
+    if _plugin.profiler is None:
+        _plugin.oncommand(unit, command, level, hue)
+    else:
+        _plugin.profiler.call("onCommand", _plugin.oncommand, unit, command, level, hue)
 
 def onConfigurationChanged():
     _plugin.readOptions()
@@ -0,0 +1,109 @@
+"""
+Before/after benchmark of the per-heartbeat HTTP cost of the Remeha Home plugin.
+
+Starts a local HTTPS stand-in for api.bdrthermea.net (self-signed certificate, needs
+the openssl binary; falls back to plain HTTP otherwise) and times a simulated heartbeat
+that fetches the dashboard:
+
+  before: a new requests.Session per heartbeat that is closed afterwards
+  after:  the long-lived keep-alive session of the plugin (create_session in plugin.py,
+          loaded through tools/harness.py)
+
+Usage: python tools/bench_session.py [heartbeats]
+"""
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from harness import default_parameters, load_plugin
+
+DASHBOARD = json.dumps({"appliances": [{"applianceId": "bench", "climateZones": []}]}).encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(DASHBOARD)))
+        self.end_headers()
+        self.wfile.write(DASHBOARD)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(workdir):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    scheme = "http"
+    cert = os.path.join(workdir, "cert.pem")
+    key = os.path.join(workdir, "key.pem")
+    try:
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+             "-subj", "/CN=localhost", "-keyout", key, "-out", cert],
+            check=True, capture_output=True,
+        )
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+    except (OSError, subprocess.CalledProcessError):
+        print("openssl not available, benchmarking over plain HTTP")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{scheme}://127.0.0.1:{server.server_address[1]}/Mobile/api/homes/dashboard"
+
+
+def plugin_session(workdir):
+    # The session the plugin itself uses, with its adapter and metrics
+    plugin = load_plugin(default_parameters(workdir))
+    return plugin.create_session(plugin.Metrics())
+
+
+def run(label, heartbeats, heartbeat):
+    timings = []
+    for _ in range(heartbeats):
+        start = time.perf_counter()
+        heartbeat()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(f"{label:<8} p50={statistics.median(timings):7.2f} ms  "
+          f"p95={timings[int(len(timings) * 0.95) - 1]:7.2f} ms  mean={statistics.mean(timings):7.2f} ms")
+
+
+def main():
+    heartbeats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as workdir:
+        server, url = start_server(workdir)
+
+        def before():
+            session = requests.Session()
+            session.get(url, verify=False).json()
+            session.close()
+
+        shared = plugin_session(workdir)
+
+        def after():
+            shared.get(url, verify=False).json()
+
+        requests.packages.urllib3.disable_warnings()
+        print(f"{heartbeats} heartbeats against {url}")
+        run("before", heartbeats, before)
+        run("after", heartbeats, after)
+        shared.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
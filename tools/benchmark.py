@@ -0,0 +1,161 @@
+"""
+Heartbeat benchmark for plugin.py, without Domoticz and without the real Remeha cloud.
+
+Loads the plugin against the Domoticz stub (tools/domoticz_stub) and the local mock
+server (tools/mock_server.py), then drives onStart, onHeartbeat and onCommand through
+many simulated poll cycles. Every cycle makes the dashboard poll due, runs the heartbeat
+that hands it to the worker, waits for the worker and runs the heartbeat that applies the
+result. Every --energy-every cycles the energy fetch is made due as well, and every
+--command-every cycles a setpoint command is sent.
+
+Reported: per-callback latency percentiles, end-to-end cycle time, HTTP calls per cycle,
+device writes per cycle and peak traced memory. With --max-heartbeat-p95 the script exits
+non-zero when the heartbeat p95 exceeds the given number of milliseconds, for use in CI.
+
+Usage: python tools/benchmark.py [--cycles 200] [--latency 0.02] [--json]
+"""
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from harness import Domoticz, default_parameters, load_plugin
+from mock_server import MockRemehaServer
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": ordered[-1],
+        "mean": statistics.mean(ordered),
+    }
+
+
+class Timer:
+    def __init__(self):
+        self.samples = {}
+
+    def call(self, name, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.samples.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+        return result
+
+
+def wait_idle(plugin, timeout=30):
+    deadline = time.monotonic() + timeout
+    while plugin._plugin.worker.pending():
+        if time.monotonic() > deadline:
+            raise RuntimeError("worker did not finish in time")
+        time.sleep(0.001)
+
+
+def run(args):
+    timer = Timer()
+    with tempfile.TemporaryDirectory() as home, MockRemehaServer(latency=args.latency) as server:
+        plugin = load_plugin(
+            default_parameters(home, Mode3=str(args.poll_interval)),
+            server.environment(),
+        )
+        # Commands should be sent within the cycle instead of after the normal debounce window
+        plugin.COMMAND_DEBOUNCE = 0
+
+        tracemalloc.start()
+        timer.call("onStart", plugin.onStart)
+        scheduler = plugin._plugin.scheduler
+
+        # Warm up: login, first dashboard and energy fetch
+        for _ in range(3):
+            scheduler.schedule("dashboard", 0)
+            timer.call("onHeartbeat (warm-up)", plugin.onHeartbeat)
+            wait_idle(plugin)
+        timer.call("onHeartbeat (warm-up)", plugin.onHeartbeat)
+
+        http_before = server.stats()["total"]
+        writes_before = len(Domoticz.updates)
+        cycle_times = []
+        setpoint = 18.0
+        for cycle in range(args.cycles):
+            start = time.perf_counter()
+            scheduler.schedule("dashboard", 0)
+            if args.energy_every and cycle % args.energy_every == 0:
+                scheduler.schedule("energy", 0)
+            if args.command_every and cycle % args.command_every == 0:
+                setpoint = 18.0 if setpoint >= 23.0 else setpoint + 0.5
+                timer.call("onCommand", plugin.onCommand, 4, "Set Level", setpoint, 0)
+            timer.call("onHeartbeat", plugin.onHeartbeat)
+            wait_idle(plugin)
+            timer.call("onHeartbeat", plugin.onHeartbeat)
+            cycle_times.append((time.perf_counter() - start) * 1000)
+
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        http_calls = server.stats()["total"] - http_before
+        writes = len(Domoticz.updates) - writes_before
+        timer.call("onStop", plugin.onStop)
+        errors = [message for level, message in Domoticz.log if level == "Error"]
+
+    return {
+        "cycles": args.cycles,
+        "latency_s": args.latency,
+        "callbacks_ms": {name: percentiles(samples) for name, samples in timer.samples.items()},
+        "cycle_ms": percentiles(cycle_times),
+        "http_calls_per_cycle": http_calls / args.cycles,
+        "device_writes_per_cycle": writes / args.cycles,
+        "peak_memory_kib": peak / 1024,
+        "errors": errors,
+    }
+
+
+def report(result):
+    print(f"{result['cycles']} cycles, mock latency {result['latency_s'] * 1000:.0f} ms")
+    print(f"{'callback':<22}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = dict(result["callbacks_ms"], **{"cycle (end-to-end)": result["cycle_ms"]})
+    for name, stats in rows.items():
+        print(f"{name:<22}{stats['count']:>7}{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['p99']:>10.3f}{stats['max']:>10.3f}")
+    print(f"HTTP calls per cycle:    {result['http_calls_per_cycle']:.2f}")
+    print(f"Device writes per cycle: {result['device_writes_per_cycle']:.2f}")
+    print(f"Peak traced memory:      {result['peak_memory_kib']:.0f} KiB")
+    for message in result["errors"]:
+        print(f"plugin error: {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cycles", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0, help="mock server latency in seconds")
+    parser.add_argument("--poll-interval", type=int, default=60)
+    parser.add_argument("--energy-every", type=int, default=60, help="make the energy fetch due every N cycles")
+    parser.add_argument("--command-every", type=int, default=25, help="send a setpoint command every N cycles")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--max-heartbeat-p95", type=float, default=None, help="fail when the heartbeat p95 exceeds this (ms)")
+    args = parser.parse_args()
+
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        report(result)
+
+    if args.max_heartbeat_p95 is not None:
+        p95 = result["callbacks_ms"]["onHeartbeat"]["p95"]
+        if p95 > args.max_heartbeat_p95:
+            print(f"onHeartbeat p95 {p95:.3f} ms exceeds {args.max_heartbeat_p95} ms", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Checks that token renewal in plugin.py is single-flight, against the local mock server.
+
+Starts the plugin on the Domoticz stub, then lets --callers threads ask the TokenManager
+for an access token at the same moment, first without any token (credential login) and
+then with an expired access token and a valid refresh token (refresh grant). The mock
+login is slowed down so the callers really overlap. Exactly one login and one refresh
+may reach the mock; every caller has to get the same token.
+
+Exits non-zero when the check fails, for use in CI.
+
+Usage: python tools/check_single_flight.py [--callers 8] [--latency 0.05]
+"""
+import argparse
+import sys
+import tempfile
+import threading
+import time
+
+from harness import default_parameters, load_plugin
+from mock_server import MockRemehaServer
+
+
+def race(tokens, callers):
+    # Release all callers at once and collect the tokens they got
+    start = threading.Event()
+    results = []
+
+    def call():
+        start.wait()
+        results.append(tokens.get_access_token())
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join(30)
+    return results
+
+
+def check(name, results, callers, requests):
+    ok = len(results) == callers and len(set(results)) == 1 and results[0] is not None and requests == 1
+    print(f"{'ok' if ok else 'FAIL'}: {name}, {callers} callers, {requests} request(s), {len(set(results))} distinct token(s)")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--callers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05, help="mock server latency in seconds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home, MockRemehaServer(latency=args.latency) as server:
+        plugin = load_plugin(default_parameters(home), server.environment())
+        # No onStart: the worker would log in on its own and the count would include it
+        api = plugin._plugin
+        api.readOptions()
+        api.state = plugin.StateStore(plugin.plugin_data_path("state"), api.email)
+        api.tokens.load(api.state)
+
+        results = race(api.tokens, args.callers)
+        ok = check("credential login", results, args.callers, server.stats()["logins"])
+
+        # Let the access token expire; the refresh token stays valid
+        api.tokens._expires_at = time.time()
+        results = race(api.tokens, args.callers)
+        ok = check("refresh", results, args.callers, server.stats()["refreshes"]) and ok
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
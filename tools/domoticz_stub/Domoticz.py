@@ -0,0 +1,139 @@
+"""
+In-process stand-in for the Domoticz embedded Python module.
+
+Mirrors the parts of the Domoticz plugin framework API that plugin.py uses: logging,
+Heartbeat and the Device class with Create/Update/Delete. Devices created here land in
+the module-level Devices dict, which tools/harness.py injects into the plugin like
+Domoticz does. Everything the plugin does is also recorded (log lines, heartbeat
+changes, device writes) so benchmarks and checks can inspect it.
+"""
+import datetime
+import threading
+
+Devices = {}
+Parameters = {}
+
+# Recorded plugin activity
+log = []
+heartbeats = []
+updates = []
+debugging = 0
+
+_lock = threading.Lock()
+_next_id = 1
+
+
+def _record(level, message):
+    with _lock:
+        log.append((level, str(message)))
+
+
+def Log(message):
+    _record("Status", message)
+
+
+def Status(message):
+    _record("Status", message)
+
+
+def Error(message):
+    _record("Error", message)
+
+
+def Debug(message):
+    if debugging:
+        _record("Debug", message)
+
+
+def Debugging(mask):
+    global debugging
+    debugging = mask
+
+
+def Heartbeat(seconds):
+    heartbeats.append(seconds)
+
+
+def Notifier(name):
+    pass
+
+
+def Trace(enabled):
+    pass
+
+
+def reset():
+    # Forget all devices and recorded activity, for a fresh plugin start
+    Devices.clear()
+    Parameters.clear()
+    del log[:]
+    del heartbeats[:]
+    del updates[:]
+
+
+class Device:
+    def __init__(self, Name="", Unit=0, TypeName="", Type=0, Subtype=0, Switchtype=0, Image=0,
+                 Options=None, Used=0, DeviceID="", Description=""):
+        self.Name = Name
+        self.Unit = Unit
+        self.TypeName = TypeName
+        self.Type = Type
+        self.SubType = Subtype
+        self.SwitchType = Switchtype
+        self.Image = Image
+        self.Options = dict(Options or {})
+        self.Used = Used
+        self.DeviceID = DeviceID or str(Unit)
+        self.Description = Description
+        self.ID = 0
+        self.nValue = 0
+        self.sValue = ""
+        self.TimedOut = 0
+        self.BatteryLevel = 255
+        self.SignalLevel = 12
+        self.LastLevel = 0
+        self.LastUpdate = ""
+
+    def __str__(self):
+        return f"Unit: {self.Unit}, Name: '{self.Name}', nValue: {self.nValue}, sValue: '{self.sValue}'"
+
+    def Create(self):
+        global _next_id
+        if self.Unit in Devices:
+            Error(f"Device creation failed, unit {self.Unit} already exists")
+            return
+        with _lock:
+            self.ID = _next_id
+            _next_id += 1
+        self.LastUpdate = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        Devices[self.Unit] = self
+
+    def Update(self, nValue, sValue, Image=None, SignalLevel=None, BatteryLevel=None, Options=None,
+               TimedOut=0, Name=None, TypeName=None, Type=None, Subtype=None, Switchtype=None,
+               Used=None, Description=None, Color=None, SuppressTriggers=False):
+        if not isinstance(sValue, str):
+            raise TypeError("sValue must be a string")
+        self.nValue = int(nValue)
+        self.sValue = sValue
+        self.TimedOut = TimedOut
+        if Options is not None:
+            self.Options = dict(Options)
+        if Name is not None:
+            self.Name = Name
+        if Image is not None:
+            self.Image = Image
+        if Used is not None:
+            self.Used = Used
+        if Description is not None:
+            self.Description = Description
+        self.LastUpdate = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        updates.append((self.Unit, self.nValue, sValue, threading.current_thread().name))
+
+    def Touch(self):
+        self.LastUpdate = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def Refresh(self):
+        pass
+
+    def Delete(self):
+        Devices.pop(self.Unit, None)
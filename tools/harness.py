@@ -0,0 +1,58 @@
+"""
+Loads plugin.py outside Domoticz: the Domoticz stub from tools/domoticz_stub is put on the
+import path and the Devices and Parameters globals are injected into the plugin module the
+way the embedded interpreter does.
+"""
+import importlib
+import os
+import sys
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TOOLS)
+
+for path in (os.path.join(TOOLS, "domoticz_stub"), ROOT):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import Domoticz  # noqa: E402
+
+
+def default_parameters(home_folder, **overrides):
+    parameters = {
+        "HardwareID": 1,
+        "HomeFolder": home_folder.rstrip("/") + "/",
+        "StartupFolder": home_folder.rstrip("/") + "/",
+        "UserDataFolder": home_folder.rstrip("/") + "/",
+        "Key": "RemehaHome",
+        "Name": "Remeha Home",
+        "Author": "",
+        "Version": "",
+        "Language": "en",
+        "Address": "",
+        "Port": "",
+        "Username": "",
+        "Password": "",
+        "SerialPort": "",
+        "Mode1": "user@example.com",
+        "Mode2": "secret",
+        "Mode3": "60",
+        "Mode4": "15",
+        "Mode5": "",
+        "Mode6": "",
+        "DomoticzVersion": "2024.7",
+    }
+    parameters.update(overrides)
+    return parameters
+
+
+def load_plugin(parameters, environment=None):
+    # Import a fresh copy of plugin.py bound to the stub; environment (e.g. the mock server
+    # base URLs) is applied before the import because the plugin reads it at import time
+    os.environ.update(environment or {})
+    Domoticz.reset()
+    Domoticz.Parameters.update(parameters)
+    sys.modules.pop("plugin", None)
+    plugin = importlib.import_module("plugin")
+    plugin.Devices = Domoticz.Devices
+    plugin.Parameters = Domoticz.Parameters
+    return plugin
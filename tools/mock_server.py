@@ -0,0 +1,484 @@
+"""
+Local stand-in for the Remeha Home cloud, for offline testing and benchmarking of plugin.py.
+
+Implements the parts of the Azure B2C login used by RemehaHomeAPI.resolve_external_data
+(authorize, SelfAsserted, confirmed), the OAuth2 token endpoint (authorization_code with
+PKCE and refresh_token grants), /homes/dashboard, the yearly/monthly/daily energyconsumption
+endpoints and the climate zone mode POSTs. Responses are built from the anonymised fixtures
+in tools/fixtures; zone mode POSTs change the dashboard that is served afterwards.
+
+Latency and errors can be injected from the command line or at runtime:
+
+  GET  /_mock/stats    request counts per endpoint
+  POST /_mock/config   JSON with any of latency, jitter, error_rate, errors, token_ttl, etag
+  POST /_mock/reset    reset counters, tokens and the dashboard
+
+Point the plugin at it through the environment:
+
+  REMEHA_LOGIN_BASE_URL=http://127.0.0.1:8080/bdrb2cprod.onmicrosoft.com
+  REMEHA_API_BASE_URL=http://127.0.0.1:8080/Mobile/api
+
+Usage: python tools/mock_server.py [--port 8080] [--latency 0.05] [--error-rate 0.1]
+"""
+import argparse
+import base64
+import copy
+import datetime
+import hashlib
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+SUBSCRIPTION_KEY = "df605c5470d846fc91e848b1cc653ddf"
+LOGIN_PREFIX = "/bdrb2cprod.onmicrosoft.com"
+API_PREFIX = "/Mobile/api"
+POLICY = "/B2C_1A_RPSignUpSignInNewRoomv3.1"
+ZONE_MODES = {
+    "schedule": "Scheduling",
+    "manual": "Manual",
+    "temporary-override": "TemporaryOverride",
+    "anti-frost": "FrostProtection",
+}
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return json.load(f)
+
+
+def make_jwt(exp):
+    # Unsigned JWT, the plugin only reads the exp claim
+    def encode(obj):
+        return base64.urlsafe_b64encode(json.dumps(obj, separators=(",", ":")).encode()).rstrip(b"=").decode()
+
+    header = encode({"alg": "none", "typ": "JWT"})
+    payload = encode({"exp": int(exp), "sub": "mock-user", "jti": secrets.token_hex(8)})
+    return f"{header}.{payload}.mock"
+
+
+def parse_date(value):
+    return datetime.date.fromisoformat(value[:10])
+
+
+class MockState:
+    def __init__(self, email, password, latency=0.0, jitter=0.0, error_rate=0.0, token_ttl=3600, etag=False, seed=None):
+        self.email = email
+        self.password = password
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        # Answer conditional dashboard requests with ETag / 304 Not Modified
+        self.etag = etag
+        # Endpoint name -> HTTP status that endpoint always answers with
+        self.errors = {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.energy = load_fixture("energy.json")
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.dashboard = load_fixture("dashboard.json")
+            self.stats = Counter()
+            self.transactions = {}
+            self.codes = {}
+            self.access_tokens = {}
+            self.refresh_tokens = set()
+
+    def issue_tokens(self):
+        access_token = make_jwt(time.time() + self.token_ttl)
+        refresh_token = secrets.token_urlsafe(32)
+        self.access_tokens[access_token] = time.time() + self.token_ttl
+        self.refresh_tokens.add(refresh_token)
+        return {
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "token_type": "Bearer",
+            "expires_in": self.token_ttl,
+        }
+
+    def energy_row(self, day):
+        template = self.energy["daily"][day.toordinal() % len(self.energy["daily"])]
+        return dict(template)
+
+    def energy_rows(self, period, start, end):
+        # One row per day, month or year in [start, end], clipped to the installation date and today
+        first = max(start, datetime.date.fromisoformat(self.energy["installedOn"]))
+        last = min(end, datetime.date.today())
+        rows = {}
+        day = first
+        while day <= last:
+            if period == "daily":
+                key = day
+            elif period == "monthly":
+                key = day.replace(day=1)
+            else:
+                key = day.replace(month=1, day=1)
+            row = rows.setdefault(key, Counter())
+            row.update(self.energy_row(day))
+            day += datetime.timedelta(days=1)
+        data = []
+        for key in sorted(rows):
+            row = {name: round(value, 3) for name, value in rows[key].items()}
+            row["timeStamp"] = f"{key.isoformat()}T00:00:00+00:00"
+            row["producerPerformanceStatistics"] = copy.deepcopy(self.energy["producerPerformanceStatistics"])
+            data.append(row)
+        return data
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server_version = "RemehaMock/1.0"
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            super().log_message(*args)
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    # --- plumbing
+
+    def dispatch(self, method):
+        url = urllib.parse.urlparse(self.path)
+        query = {key: values[0] for key, values in urllib.parse.parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        if url.path.startswith("/_mock/"):
+            return self.control(method, url.path, body)
+
+        route = self.route(method, url.path)
+        if route is None:
+            return self.send_json(404, {"error": "not found", "path": url.path})
+        name, handler, args = route
+
+        state = self.state
+        with state.lock:
+            state.stats[name] += 1
+            state.stats["total"] += 1
+            delay = state.latency + (state.random.uniform(0, state.jitter) if state.jitter else 0)
+            forced = state.errors.get(name)
+            random_error = state.error_rate and state.random.random() < state.error_rate
+        if delay:
+            time.sleep(delay)
+        if forced:
+            return self.send_json(forced, {"error": f"injected {forced}"})
+        if random_error:
+            return self.send_json(500, {"error": "injected random failure"})
+        handler(query, body, *args)
+
+    def route(self, method, path):
+        if path.startswith(LOGIN_PREFIX):
+            path = path[len(LOGIN_PREFIX):]
+            routes = {
+                ("GET", "/oauth2/v2.0/authorize"): ("authorize", self.authorize),
+                ("POST", POLICY + "/SelfAsserted"): ("selfasserted", self.self_asserted),
+                ("GET", POLICY + "/api/CombinedSigninAndSignup/confirmed"): ("confirmed", self.confirmed),
+                ("POST", "/oauth2/v2.0/token"): ("token", self.token),
+            }
+            match = routes.get((method, path))
+            return (*match, ()) if match else None
+        if not path.startswith(API_PREFIX):
+            return None
+        parts = path[len(API_PREFIX):].strip("/").split("/")
+        if method == "GET" and parts == ["homes", "dashboard"]:
+            return "dashboard", self.dashboard, ()
+        if method == "GET" and len(parts) == 4 and parts[0] == "appliances" and parts[2] == "energyconsumption":
+            if parts[3] in ("yearly", "monthly", "daily"):
+                return f"energy_{parts[3]}", self.energy, (parts[1], parts[3])
+        if method == "POST" and len(parts) == 4 and parts[0] == "climate-zones" and parts[2] == "modes":
+            if parts[3] in ZONE_MODES:
+                return "zone_mode", self.zone_mode, (parts[1], parts[3])
+        return None
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_empty(self, status, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def form(self, body):
+        return {key: values[0] for key, values in urllib.parse.parse_qs(body.decode()).items()}
+
+    def cookie(self, name):
+        for part in (self.headers.get("Cookie") or "").split(";"):
+            key, _, value = part.strip().partition("=")
+            if key == name:
+                return value
+        return None
+
+    # --- control
+
+    def control(self, method, path, body):
+        state = self.state
+        if method == "GET" and path == "/_mock/stats":
+            with state.lock:
+                return self.send_json(200, dict(state.stats))
+        if method == "POST" and path == "/_mock/config":
+            config = json.loads(body or b"{}")
+            with state.lock:
+                for key in ("latency", "jitter", "error_rate", "token_ttl"):
+                    if key in config:
+                        setattr(state, key, float(config[key]))
+                if "etag" in config:
+                    state.etag = bool(config["etag"])
+                if "errors" in config:
+                    state.errors = {name: int(status) for name, status in config["errors"].items()}
+            return self.send_json(200, {"ok": True})
+        if method == "POST" and path == "/_mock/reset":
+            state.reset()
+            return self.send_json(200, {"ok": True})
+        return self.send_json(404, {"error": "unknown control endpoint"})
+
+    # --- B2C login
+
+    def authorize(self, query, body):
+        if query.get("code_challenge_method") != "S256" or not query.get("code_challenge"):
+            return self.send_json(400, {"error": "PKCE S256 code challenge required"})
+        request_id = secrets.token_hex(16)
+        csrf = secrets.token_urlsafe(24)
+        tx = base64.urlsafe_b64encode(json.dumps({"TID": request_id}).replace(" ", "").encode()).decode().rstrip("=")
+        with self.state.lock:
+            self.state.transactions[tx] = {
+                "csrf": csrf,
+                "challenge": query["code_challenge"],
+                "authenticated": False,
+            }
+        self.send_json(
+            200,
+            {"page": "login"},
+            {"x-request-id": request_id, "Set-Cookie": f"x-ms-cpim-csrf={csrf}; Path=/"},
+        )
+
+    def transaction(self, query):
+        tx = (query.get("tx") or "").replace("StateProperties=", "", 1)
+        return self.state.transactions.get(tx)
+
+    def self_asserted(self, query, body):
+        transaction = self.transaction(query)
+        csrf = self.headers.get("x-csrf-token")
+        if transaction is None or csrf != transaction["csrf"] or csrf != self.cookie("x-ms-cpim-csrf"):
+            return self.send_json(403, {"status": "403", "message": "CSRF validation failed"})
+        form = self.form(body)
+        if form.get("signInName") != self.state.email or form.get("password") != self.state.password:
+            return self.send_json(200, {"status": "400", "message": "Invalid username or password."})
+        transaction["authenticated"] = True
+        self.send_json(200, {"status": "200"})
+
+    def confirmed(self, query, body):
+        transaction = self.transaction(query)
+        if transaction is None or not transaction["authenticated"] or query.get("csrf_token") != transaction["csrf"]:
+            return self.send_json(400, {"error": "not authenticated"})
+        code = secrets.token_urlsafe(24)
+        with self.state.lock:
+            self.state.codes[code] = transaction["challenge"]
+        self.send_empty(302, {"Location": f"com.b2c.remehaapp://login-callback?state=mock&code={code}"})
+
+    def token(self, query, body):
+        form = self.form(body)
+        state = self.state
+        with state.lock:
+            if form.get("grant_type") == "authorization_code":
+                challenge = state.codes.pop(form.get("code"), None)
+                verifier = form.get("code_verifier", "")
+                expected = base64.urlsafe_b64encode(hashlib.sha256(verifier.encode()).digest()).decode().rstrip("=")
+                if challenge is None or challenge != expected:
+                    return self.send_json(400, {"error": "invalid_grant", "error_description": "bad authorization code"})
+                state.stats["logins"] += 1
+                return self.send_json(200, state.issue_tokens())
+            if form.get("grant_type") == "refresh_token":
+                if form.get("refresh_token") not in state.refresh_tokens:
+                    return self.send_json(400, {"error": "invalid_grant", "error_description": "unknown refresh token"})
+                state.refresh_tokens.discard(form["refresh_token"])
+                state.stats["refreshes"] += 1
+                return self.send_json(200, state.issue_tokens())
+        self.send_json(400, {"error": "unsupported_grant_type", "error_description": "unsupported grant type"})
+
+    # --- API
+
+    def authorized(self):
+        if self.headers.get("Ocp-Apim-Subscription-Key") != SUBSCRIPTION_KEY:
+            self.send_json(401, {"statusCode": 401, "message": "Access denied due to missing subscription key."})
+            return False
+        token = (self.headers.get("Authorization") or "").replace("Bearer ", "", 1)
+        with self.state.lock:
+            expires = self.state.access_tokens.get(token)
+        if expires is None or expires < time.time():
+            self.send_json(401, {"statusCode": 401, "message": "Unauthorized"})
+            return False
+        return True
+
+    def dashboard(self, query, body):
+        if not self.authorized():
+            return
+        with self.state.lock:
+            payload = copy.deepcopy(self.state.dashboard)
+            etag = self.state.etag
+        if not etag:
+            return self.send_json(200, payload)
+        tag = '"' + hashlib.sha1(json.dumps(payload).encode()).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == tag:
+            return self.send_empty(304, {"ETag": tag})
+        self.send_json(200, payload, {"ETag": tag})
+
+    def energy(self, query, body, appliance_id, period):
+        if not self.authorized():
+            return
+        with self.state.lock:
+            known = [appliance["applianceId"] for appliance in self.state.dashboard["appliances"]]
+        if appliance_id not in known:
+            return self.send_json(404, {"error": "unknown appliance"})
+        try:
+            start = parse_date(query["startDate"])
+            end = parse_date(query["endDate"])
+        except (KeyError, ValueError):
+            return self.send_json(400, {"error": "startDate and endDate are required"})
+        self.send_json(200, {
+            "startDateTimeUsed": query["startDate"],
+            "endDateTimeUsed": query["endDate"],
+            "data": self.state.energy_rows(period, start, end),
+        })
+
+    def zone_mode(self, query, body, zone_id, mode):
+        if not self.authorized():
+            return
+        payload = json.loads(body or b"{}")
+        with self.state.lock:
+            zones = [
+                zone
+                for appliance in self.state.dashboard["appliances"]
+                for zone in appliance["climateZones"]
+                if zone["climateZoneId"] == zone_id
+            ]
+            if not zones:
+                return self.send_json(404, {"error": "unknown climate zone"})
+            zone = zones[0]
+            if mode in ("manual", "temporary-override"):
+                if "roomTemperatureSetPoint" not in payload:
+                    return self.send_json(400, {"error": "roomTemperatureSetPoint is required"})
+                zone["setPoint"] = float(payload["roomTemperatureSetPoint"])
+            zone["zoneMode"] = ZONE_MODES[mode]
+        self.send_empty(200)
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # A client that gave up on a slow response (read timeout) is expected, not an error
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class MockRemehaServer:
+    # Runs the stand-in in a background thread, for use from scripts and benchmarks
+    def __init__(self, host="127.0.0.1", port=0, email="user@example.com", password="secret", verbose=False, **config):
+        self.state = MockState(email, password, **config)
+        self.httpd = MockHTTPServer((host, port), Handler)
+        self.httpd.state = self.state
+        self.httpd.verbose = verbose
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def login_base_url(self):
+        return self.base_url + LOGIN_PREFIX
+
+    @property
+    def api_base_url(self):
+        return self.base_url + API_PREFIX
+
+    def environment(self):
+        # Environment variables that point plugin.py at this server
+        return {"REMEHA_LOGIN_BASE_URL": self.login_base_url, "REMEHA_API_BASE_URL": self.api_base_url}
+
+    def stats(self):
+        with self.state.lock:
+            return Counter(self.state.stats)
+
+    def configure(self, **config):
+        with self.state.lock:
+            for key, value in config.items():
+                setattr(self.state, key, value)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="RemehaMock", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--email", default="user@example.com")
+    parser.add_argument("--password", default="secret")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency, up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--token-ttl", type=int, default=3600, help="access token lifetime in seconds")
+    parser.add_argument("--etag", action="store_true", help="support conditional dashboard requests")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = MockRemehaServer(
+        args.host, args.port, args.email, args.password, args.verbose,
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        token_ttl=args.token_ttl, etag=args.etag, seed=args.seed,
+    )
+    for name, value in server.environment().items():
+        print(f"{name}={value}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()